@@ -0,0 +1,139 @@
+from datetime import datetime
+import SyntheticAdt as syn
+import AdtEvents as adt
+import PatientStays as ps
+import PatientCensus as pc
+import xlsxutil
+import pandas as pd
+import subprocess
+import sys
+import tracemalloc
+import tempfile
+import platform
+import time
+import json
+import os
+
+# Times and memory-profiles each stage of the pipeline on synthetic ADT extracts and appends
+# the results as json lines to a results file, so regressions are visible from run to run.
+
+scales = {'1 month': 30,
+          '1 year': 365,
+          '5 years': 5 * 365
+          }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+# the library modules whose import time is recorded, which should stay in milliseconds
+startup_modules = ['Event', 'AdtEvents', 'PatientStays', 'PatientCensus', 'xlsxutil']
+
+
+def import_seconds(module: str) -> float:
+    '''
+    Imports module in a fresh interpreter with -X importtime and returns its cumulative import time in
+    seconds, which includes every module it imports that was not already loaded by the interpreter.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    for line in reversed(result.stderr.splitlines()):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError(f'No import time was reported for "{module}".')
+
+
+def measure(func, *args, memory: bool = True, **kwargs) -> tuple:
+    '''
+    Calls func and returns its result, the elapsed seconds, and the peak bytes allocated during the call.
+    tracemalloc slows everything down, so when memory is True func is called a second time to measure
+    the peak separately from the timing. Otherwise the peak is returned as None.
+    '''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(scale: str, days: int, directory: str, encounters_per_day: float = 60, memory: bool = True) -> list:
+    '''Runs every stage once at the given scale and returns a list of result dicts.'''
+    dept_synonyms = {'MEDA': 'MED A', 'Med A': 'MED A'}
+    files = syn.write_synthetic_extracts(directory, datetime(2021, 1, 1), days, encounters_per_day=encounters_per_day,
+                                         dept_synonyms=dept_synonyms)
+    results = []
+
+    def record(stage: str, seconds: float, peak: int, **counts) -> None:
+        results.append({'scale': scale, 'stage': stage, 'seconds': round(seconds, 4), 'peak_bytes': peak, **counts})
+        print(f'{scale:>8} {stage:<28} {seconds:10.3f} s' + ('' if peak is None else f' {peak / 2**20:10.1f} MiB'))
+
+    events, seconds, peak = measure(adt.read_from_csv, files, dept_synonyms, memory=memory)
+    rows = sum(len(event_set) for event_set in events.data.values())
+    record('read_from_csv', seconds, peak, files=len(files), encounters=len(events.data), events=rows)
+
+    events, seconds, peak = measure(adt.read_from_csv_vectorized, files, dept_synonyms, memory=memory)
+    record('read_from_csv_vectorized', seconds, peak, encounters=len(events.data))
+
+    stays, seconds, peak = measure(ps.build_dataset, events, memory=memory)
+    record('build_dataset', seconds, peak, stays=len(stays))
+
+    census, seconds, peak = measure(pc.build_DataFrame, pd.Timestamp(events.start_date), pd.Timestamp(events.end_date), stays, memory=memory)
+    record('build_DataFrame', seconds, peak, hours=len(census), columns=census.shape[1])
+
+    descriptors = [{'sheet_name': 'Stays', 'data_frame': stays, 'display_name': 'Stays'},
+                   {'sheet_name': 'Census', 'data_frame': census, 'display_name': 'Census'}]
+    result, seconds, peak = measure(xlsxutil.create_xlsx_with_tables, os.path.join(directory, 'benchmark.xlsx'), descriptors, memory=memory)
+    record('create_xlsx_with_tables', seconds, peak)
+    return results
+
+
+def run_all(results_file: str, selected: list = None, encounters_per_day: float = 60, memory: bool = True) -> None:
+    '''Runs the selected scales (all of them by default) and appends the results to results_file.'''
+    run_info = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'machine': platform.machine()
+                }
+    with open(results_file, 'a') as f:
+        for module in startup_modules:
+            seconds = import_seconds(module)
+            print(f'{"startup":>8} {"import " + module:<28} {seconds:10.3f} s')
+            f.write(json.dumps({'scale': 'startup', 'stage': 'import ' + module, 'seconds': round(seconds, 4), 'peak_bytes': None, **run_info}) + '\n')
+        for scale, days in scales.items():
+            if selected and scale not in selected:
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                for result in run(scale, days, directory, encounters_per_day, memory):
+                    result.update(run_info)
+                    f.write(json.dumps(result) + '\n')
+
+
+# for testing
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the ADT pipeline on synthetic data.')
+    parser.add_argument('--scale', action='append', choices=list(scales.keys()), help='scale to run, may be repeated (default: all)')
+    parser.add_argument('--encounters-per-day', type=float, default=60)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs used to measure peak memory')
+    parser.add_argument('--results', default='./output files/benchmark_results.jsonl')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    run_all(args.results, args.scale, args.encounters_per_day, not args.no_memory)
+
+    print('Done!')
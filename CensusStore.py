@@ -0,0 +1,196 @@
+from PatientCensus import bin_width_of, _timestamp_columns
+from xlsxutil import IncrementalSmoother
+import pandas as pd
+import numpy as np
+import json
+import os
+
+# A census store is a directory with one raw float64 file per census column and a meta.json file
+# listing the columns, the timestamp of the first row, the row frequency and the number of rows.
+# The time axis is implicit, row i is start + i * freq, so a date range maps straight to a slice of
+# rows, and since each column is its own file a query only reads the pages of the columns and rows
+# it asks for. Appending writes to the end of each file and then replaces meta.json, so history is
+# never rewritten and a failed append leaves the store as it was.
+
+store_version = 1
+
+# the census columns that are derived from the timestamps and not stored
+_timestamp_fields = ['Timestamp', 'Hour', 'Weekday']
+
+
+class CensusStore:
+    '''
+    A persistent, appendable census with the columns of PatientCensus.build_DataFrame() (the unit columns,
+    'Total Census' and any staffing model columns), stored as memory-mapped arrays.
+
+    directory:  the store directory, which is created by the first append() if it does not exist.
+    freq:       the row frequency of a new store. An existing store keeps the frequency it was created with.
+    '''
+
+    def __init__(self, directory: str, freq: str = 'h'):
+        self.directory = directory
+        path = os.path.join(directory, 'meta.json')
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                meta = json.load(f)
+            if meta['version'] != store_version:
+                raise ValueError(f'Unsupported census store version {meta["version"]}.')
+            self.__meta = meta
+        else:
+            self.__meta = {'version': store_version, 'start': None, 'freq': freq, 'rows': 0, 'columns': []}
+        self.__width = bin_width_of(self.__meta['freq'])
+
+    @property
+    def freq(self) -> str:
+        return self.__meta['freq']
+
+    @property
+    def columns(self) -> list:
+        return list(self.__meta['columns'])
+
+    @property
+    def start_date(self) -> pd.Timestamp:
+        return None if self.__meta['start'] is None else pd.Timestamp(self.__meta['start'])
+
+    @property
+    def end_date(self) -> pd.Timestamp:
+        '''The timestamp of the row that the next append() must start with.'''
+        return None if self.__meta['start'] is None else self.start_date + len(self) * pd.Timedelta(self.__width, unit='ns')
+
+    def __len__(self) -> int:
+        return self.__meta['rows']
+
+    def __file(self, n: int) -> str:
+        return os.path.join(self.directory, f'{n}.f8')
+
+    def __write_meta(self, meta: dict) -> None:
+        path = os.path.join(self.directory, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+        self.__meta = meta
+
+    def append(self, census: pd.DataFrame) -> None:
+        '''
+        Appends the rows of a census table from build_DataFrame(), which must start at end_date and have the
+        store's frequency. Columns that are new to the store are zero for the rows before them, and columns
+        of the store that census does not have are zero for its rows.
+        '''
+        timestamps = pd.DatetimeIndex(census['Timestamp'])
+        if len(timestamps) == 0:
+            return
+        steps = np.diff(timestamps.as_unit('ns').asi8)
+        if len(steps) > 0 and (steps != self.__width).any():
+            raise ValueError(f'The census rows are not evenly spaced by the store frequency "{self.freq}".')
+        if len(self) > 0 and timestamps[0] != self.end_date:
+            raise ValueError(f'The census starts at {timestamps[0]}, but the store can only be appended to at {self.end_date}.')
+        names = [c for c in census.columns if c not in _timestamp_fields]
+        for name in names:
+            if not isinstance(name, str):
+                raise TypeError(f'Column name {name!r} is not a string.')
+        os.makedirs(self.directory, exist_ok=True)
+        meta = dict(self.__meta, columns=self.columns + [name for name in names if name not in self.__meta['columns']])
+        if meta['start'] is None:
+            meta['start'] = timestamps[0].isoformat()
+        rows = len(self)
+        for n, name in enumerate(meta['columns']):
+            values = census[name].to_numpy(dtype=np.float64) if name in names else np.zeros(len(census))
+            with open(self.__file(n), 'ab') as f:
+                # drop anything left behind by an append that failed before meta.json was replaced
+                f.truncate(rows * 8 if n < len(self.__meta['columns']) else 0)
+                if n >= len(self.__meta['columns']) and rows > 0:
+                    np.zeros(rows).tofile(f)
+                values.tofile(f)
+        meta['rows'] = rows + len(census)
+        self.__write_meta(meta)
+
+    def __rows(self, start_date, end_date) -> tuple:
+        # the rows whose timestamps are in [start_date, end_date)
+        def row(date, default: int) -> int:
+            if date is None:
+                return default
+            offset = pd.Timestamp(date).as_unit('ns').value - self.start_date.as_unit('ns').value
+            return int(min(max(-(-offset // self.__width), 0), len(self)))
+        return row(start_date, 0), row(end_date, len(self))
+
+    def column(self, name: str, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None) -> np.ndarray:
+        '''A read-only memory-mapped view of one column between start_date and end_date.'''
+        n = self.__meta['columns'].index(name)
+        i, j = self.__rows(start_date, end_date)
+        if j <= i:
+            return np.zeros(0)
+        return np.memmap(self.__file(n), dtype=np.float64, mode='r', offset=i * 8, shape=(j - i,))
+
+    def read(self, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None, columns: list = None) -> pd.DataFrame:
+        '''
+        Returns the rows between start_date and end_date (default: all) in the layout of build_DataFrame(),
+        with only the given columns (default: all). The index holds the row numbers of the store, and the
+        numeric columns are memory-mapped, so only the pages that are used are read from disk.
+        '''
+        i, j = self.__rows(start_date, end_date)
+        rows = max(j - i, 0)
+        # only the timestamps of the rows that are read are generated
+        timestamps = pd.date_range(self.start_date + i * pd.Timedelta(self.__width, unit='ns'), periods=rows, freq=self.freq) if rows > 0 else pd.DatetimeIndex([])
+        census = _timestamp_columns(timestamps)
+        census.index = pd.RangeIndex(i, i + rows, name='Id')
+        names = self.columns if columns is None else list(columns)
+        data = pd.DataFrame({name: self.column(name, start_date, end_date) for name in names}, index=census.index, copy=False)
+        return pd.concat([census, data], axis=1)
+
+    def iter_frames(self, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None, columns: list = None, chunk_rows: int = 24 * 365):
+        '''Yields the rows between start_date and end_date as read() frames of at most chunk_rows rows.'''
+        i, j = self.__rows(start_date, end_date)
+        start = self.start_date
+        width = pd.Timedelta(self.__width, unit='ns')
+        for k in range(i, j, chunk_rows):
+            yield self.read(start + k * width, start + min(k + chunk_rows, j) * width, columns)
+
+    def aggregate(self, freq: str = 'D', how: str = 'mean', start_date: pd.Timestamp = None, end_date: pd.Timestamp = None,
+                  columns: list = None, chunk_rows: int = 24 * 365) -> pd.DataFrame:
+        '''
+        Resamples the columns to a coarser freq, such as 'D', 'W' or 'MS', with how one of 'mean', 'max', 'min'
+        or 'sum', reading chunk_rows rows at a time so the whole history is never in memory at once.
+        '''
+        if how not in ('mean', 'max', 'min', 'sum'):
+            raise ValueError('how must be one of "mean", "max", "min" or "sum".')
+        names = self.columns if columns is None else list(columns)
+        parts = []
+        for frame in self.iter_frames(start_date, end_date, names, chunk_rows):
+            groups = frame.set_index('Timestamp')[names].resample(freq)
+            parts.append(pd.concat({'sum': groups.sum(), 'count': groups.count()}, axis=1) if how == 'mean' else getattr(groups, how)())
+        if len(parts) == 0:
+            return pd.DataFrame(columns=names)
+        combined = pd.concat(parts)
+        grouped = combined.groupby(level=0)
+        if how == 'mean':
+            totals = grouped.sum()
+            return totals['sum'] / totals['count']
+        return getattr(grouped, 'sum' if how == 'sum' else how)()
+
+    def smoothed(self, columns: list, window_length: int, polyorder: int, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None,
+                 chunk_rows: int = 24 * 365):
+        '''
+        Yields the Savitzky-Golay smoothed columns between start_date and end_date in chunks, with the same values
+        as xlsxutil.smoothed_data() over the whole range, using an IncrementalSmoother so only one chunk of the
+        history is in memory at a time. chunk_rows and the number of rows in the range must be at least window_length.
+        '''
+        if chunk_rows < window_length:
+            raise ValueError('chunk_rows must be at least window_length.')
+        i, j = self.__rows(start_date, end_date)
+        if j - i < window_length:
+            raise ValueError(f'The range has {max(j - i, 0)} rows, which is fewer than window_length ({window_length}).')
+        return self.__smoothed(columns, window_length, polyorder, start_date, end_date, chunk_rows)
+
+    def __smoothed(self, columns: list, window_length: int, polyorder: int, start_date, end_date, chunk_rows: int):
+        smoother = IncrementalSmoother(columns, window_length, polyorder)
+        # the rows at the end of each chunk that the next chunk can still change, which IncrementalSmoother.append()
+        # returns again before the new rows
+        held = window_length // 2
+        pending = None
+        for frame in self.iter_frames(start_date, end_date, columns, chunk_rows):
+            smoothed = smoother.smooth(frame) if pending is None else smoother.append(frame)
+            if len(smoothed) > held:
+                yield smoothed.iloc[:len(smoothed) - held]
+            pending = smoothed.iloc[len(smoothed) - held:]
+        if pending is not None and len(pending) > 0:
+            yield pending
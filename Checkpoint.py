@@ -0,0 +1,154 @@
+from AdtEvents import EventDataset
+from Encounter import Encounter
+from Event import Event
+from datetime import datetime
+import pandas as pd
+import numpy as np
+import json
+import os
+
+# A checkpoint is a directory with one .npy file per column and a meta.json file describing them.
+# Numeric, boolean and datetime columns are saved as-is, so they can be memory-mapped on load
+# without copying or parsing, and keep their full timestamp precision. String columns are
+# saved as int32 codes with their unique values listed in meta.json.
+
+checkpoint_version = 1
+
+
+def save_frame(df: pd.DataFrame, directory: str, attrs: dict = {}) -> None:
+    '''
+    Saves a DataFrame, such as the stays from PatientStays.build_dataset() or the census from
+    PatientCensus.build_DataFrame(), to a checkpoint directory. attrs is an optional dict of
+    json serializable values that is returned by load_attrs(). The index and column names must be
+    strings or numbers, and a RangeIndex is restored as a RangeIndex with the same bounds.
+    '''
+    for name in [df.index.name] + list(df.columns):
+        if name is not None and type(name) not in (str, int, float):
+            raise TypeError(f'Column name {name!r} is not a string or a number, so it cannot be saved in meta.json.')
+    os.makedirs(directory, exist_ok=True)
+    meta = {'version': checkpoint_version, 'attrs': attrs, 'index': None, 'columns': []}
+    columns = [(f'col{i}', name, df.iloc[:, i]) for i, name in enumerate(df.columns)]
+    if isinstance(df.index, pd.RangeIndex):
+        # a RangeIndex, such as one from a slice of a larger frame, is saved as its bounds
+        meta['index'] = {'kind': 'range', 'name': df.index.name, 'start': df.index.start, 'stop': df.index.stop, 'step': df.index.step}
+    else:
+        columns.insert(0, ('index', df.index.name, df.index.to_series()))
+    for file, name, series in columns:
+        desc = {'file': file + '.npy', 'name': name, 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            desc['kind'] = 'category'
+            desc['categories'] = series.cat.categories.tolist()
+            desc['ordered'] = bool(series.cat.ordered)
+            values = series.cat.codes.to_numpy(dtype=np.int32)
+        elif series.dtype.kind in 'biufM' and not isinstance(series.dtype, pd.DatetimeTZDtype):
+            desc['kind'] = 'array'
+            values = series.to_numpy()
+        elif series.dtype.kind in 'OSU' or pd.api.types.is_string_dtype(series.dtype):
+            codes, uniques = pd.factorize(series)
+            if not all(isinstance(x, str) for x in uniques):
+                raise TypeError(f'Column "{name}" contains values that are not strings.')
+            desc['kind'] = 'string'
+            desc['categories'] = list(uniques)
+            values = codes.astype(np.int32)
+        else:
+            raise TypeError(f'Column "{name}" has unsupported dtype {series.dtype}.')
+        np.save(os.path.join(directory, desc['file']), values, allow_pickle=False)
+        if file == 'index':
+            meta['index'] = desc
+        else:
+            meta['columns'].append(desc)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def _load_column(directory: str, desc: dict, mmap: bool):
+    values = np.load(os.path.join(directory, desc['file']), mmap_mode='r' if mmap else None, allow_pickle=False)
+    if desc['kind'] == 'array':
+        # a plain ndarray view of the memory map, which pandas keeps without copying
+        return values.view(np.ndarray)
+    if desc['kind'] == 'category':
+        return pd.Categorical.from_codes(values, categories=desc['categories'], ordered=desc['ordered'])
+    categories = np.array(desc['categories'] + [None], dtype=object)
+    strings = categories[values]
+    return strings if desc['dtype'] == 'object' else pd.array(strings, dtype=desc['dtype'])
+
+
+def _load_meta(directory: str) -> dict:
+    with open(os.path.join(directory, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != checkpoint_version:
+        raise ValueError(f'Unsupported checkpoint version {meta["version"]}.')
+    return meta
+
+
+def load_frame(directory: str, mmap: bool = True) -> pd.DataFrame:
+    '''
+    Loads a DataFrame saved with save_frame(). When mmap is True, numeric and datetime columns are
+    read-only views of memory-mapped files, so only the pages that are used are ever read, and no
+    column is copied into memory when the frame is built.
+    '''
+    meta = _load_meta(directory)
+    desc = meta['index']
+    if desc['kind'] == 'range':
+        index = pd.RangeIndex(desc['start'], desc['stop'], desc['step'], name=desc['name'])
+    else:
+        index = pd.Index(_load_column(directory, desc, mmap), name=desc['name'], copy=False)
+    data = {i: _load_column(directory, desc, mmap) for i, desc in enumerate(meta['columns'])}
+    df = pd.DataFrame(data, index=index, copy=False)
+    df.columns = [desc['name'] for desc in meta['columns']]
+    return df
+
+
+def load_attrs(directory: str) -> dict:
+    return _load_meta(directory)['attrs']
+
+
+def save_event_dataset(dataset: EventDataset, directory: str) -> None:
+    '''
+    Saves an EventDataset as two checkpoints, 'encounters' and 'events', in directory.
+    Unlike AdtEvents.write_to_csv(), every timestamp keeps its seconds.
+    '''
+    encounter_attrs = list(dict.fromkeys(desc[2] for desc in Encounter.fieldnames.values()))
+    event_attrs = list(dict.fromkeys(desc[2] for desc in Event.fieldnames.values()))
+    encounters = {attr: [] for attr in encounter_attrs}
+    events = {attr: [] for attr in event_attrs}
+    events['encounter'] = []
+    for n, (encounter, event_set) in enumerate(dataset.data.items()):
+        for attr in encounter_attrs:
+            encounters[attr].append(getattr(encounter, attr))
+        for event in event_set:
+            for attr in event_attrs:
+                events[attr].append(getattr(event, attr))
+            events['encounter'].append(n)
+    encounters = pd.DataFrame(encounters)
+    events = pd.DataFrame(events)
+    for df, attrs in ((encounters, encounter_attrs), (events, event_attrs)):
+        for attr in attrs:
+            if attr.endswith('datetime') or attr == 'eff_date':
+                df[attr] = pd.to_datetime(df[attr]).astype('datetime64[ns]')
+    dates = {'start_date': dataset.start_date.isoformat(), 'end_date': dataset.end_date.isoformat()}
+    save_frame(encounters, os.path.join(directory, 'encounters'), dates)
+    save_frame(events, os.path.join(directory, 'events'))
+
+
+def load_event_dataset(directory: str) -> EventDataset:
+    '''Loads an EventDataset saved with save_event_dataset().'''
+
+    def columns(df: pd.DataFrame) -> list:
+        values = []
+        for name in df.columns:
+            if df[name].dtype.kind == 'M':
+                values.append([None if x is pd.NaT else x for x in df[name].dt.to_pydatetime()])
+            else:
+                values.append(df[name].tolist())
+        return values
+
+    attrs = load_attrs(os.path.join(directory, 'encounters'))
+    encounters = load_frame(os.path.join(directory, 'encounters'), mmap=False)
+    events = load_frame(os.path.join(directory, 'events'), mmap=False)
+    encounter_list = [Encounter.from_attributes(dict(zip(encounters.columns, values))) for values in zip(*columns(encounters))]
+    event_attrs = [name for name in events.columns if name != 'encounter']
+    dataset = {encounter: set() for encounter in encounter_list}
+    for n, values in zip(events['encounter'].tolist(), zip(*columns(events[event_attrs]))):
+        dataset[encounter_list[n]].add(Event.from_attributes(dict(zip(event_attrs, values))))
+    return EventDataset(datetime.fromisoformat(attrs['start_date']), datetime.fromisoformat(attrs['end_date']), dataset)
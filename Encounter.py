@@ -1,8 +1,13 @@
 
 from datetime import datetime
+import sys
 
 
 class Encounter:
+
+    # Encounters are stored in slots rather than an instance dict to keep large datasets small
+    __slots__ = ('har', 'admit_datetime', 'arrival_datetime', 'disch_datetime', 'disch_disp', 'disch_class', 'admit_dx', 'primary_dx', 'ed_dx')
+
     fieldnames = {'HAR': (11, '---', 'har'),
                   'Admit Date': (19, '----------', 'admit_datetime'),
                   'Admit Time': (0, '----------', 'admit_datetime'),
@@ -17,15 +22,20 @@ class Encounter:
                   'Diagnosis': (10, '---------', 'ed_dx')
                   }
 
-    def __init__(self, csv_row: dict):
+    def __init__(self, csv_row: dict, fields: frozenset = None):
 
         for name, desc in Encounter.fieldnames.items():
 
             attr = desc[2]
 
+            # when a set of attribute names is given, skip parsing the fields that are not in it
+            if fields is not None and attr not in fields:
+                object.__setattr__(self, attr, None)
+                continue
+
             # every encounter must have a HAR
             if name == 'HAR':
-                self.__dict__[attr] = int(csv_row[name])
+                object.__setattr__(self, attr, int(csv_row[name]))
 
             # A patient should always have an admission date and time
             elif name == 'Admit Date':
@@ -36,35 +46,35 @@ class Encounter:
                     y = datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p')
                 except BaseException:
                     y = datetime.strptime(x, '%m/%d/%Y %I:%M %p')
-                self.__dict__[attr] = y
+                object.__setattr__(self, attr, y)
 
             # the arrival date and time only applies if the patient entered through the ED
             elif name == 'Arr Date':
                 x = csv_row[name].strip()
                 y = csv_row['Arr Time'].strip()
                 if x == '<NA>' or y == '<NA>':
-                    self.__dict__[attr] = None
+                    object.__setattr__(self, attr, None)
                 else:
                     x += ' ' + y
                     try:
                         y = datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p')
                     except BaseException:
                         y = datetime.strptime(x, '%m/%d/%Y %I:%M %p')
-                    self.__dict__[attr] = y
+                    object.__setattr__(self, attr, y)
 
             # the patient may not have left yet
             elif name == 'Disch Date':
                 x = csv_row[name].strip()
                 y = csv_row['Disch Time'].strip()
                 if x == '<NA>' or y == '<NA>':
-                    self.__dict__[attr] = None
+                    object.__setattr__(self, attr, None)
                 else:
                     x += ' ' + y
                     try:
                         y = datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p')
                     except BaseException:
                         y = datetime.strptime(x, '%m/%d/%Y %I:%M %p')
-                    self.__dict__[attr] = y
+                    object.__setattr__(self, attr, y)
 
             # skip the time values already handled above
             elif name == 'Admit Time' or name == 'Arr Time' or name == 'Disch Time':
@@ -73,10 +83,21 @@ class Encounter:
             # all other required fields are simple strings
             else:
                 try:
-                    self.__dict__[attr] = csv_row[name].strip()
+                    object.__setattr__(self, attr, sys.intern(csv_row[name].strip()))
                 except BaseException:
                     raise KeyError('dict object passed to Encounter.__init__() does not contain all required fields.')
 
+    @classmethod
+    def from_attributes(cls, attributes: dict):
+        '''
+        Builds an Encounter directly from already parsed attribute values, keyed by the
+        attribute names in Encounter.fieldnames, bypassing the csv row parsing in __init__().
+        '''
+        encounter = cls.__new__(cls)
+        for attr, value in attributes.items():
+            object.__setattr__(encounter, attr, value)
+        return encounter
+
     def __eq__(self, other):
         return hash(self) == hash(other)
 
@@ -101,24 +122,14 @@ class Encounter:
     @staticmethod
     def __build_column__(value, width):
         value = datetime.strftime(value, '%m/%d/%Y %I:%M %p') if isinstance(value, datetime) else str(value)
-        length = len(value)
-        value = value[0:min(width, length)]
-        for i in range(0, width - length):
-            value += ' '
-        return value
+        return value[0:width].ljust(width)
 
     def __str__(self):
-        s1 = ''
-        s2 = ''
-        for name, desc in Encounter.fieldnames.items():
-            if name != 'Eff Time':
-                s1 += Encounter.__build_column__(name, desc[0]) + ' '
-                s2 += Encounter.__build_column__(desc[1], desc[0]) + ' '
-        s3 = '\n' + s1 + '\n' + s2 + '\n'
-        for name, desc in Encounter.fieldnames.items():
-            if name != 'Admit Time' and name != 'Arr Time' and name != 'Disch Time':
-                s3 += Encounter.__build_column__(self.__getattribute__(desc[2]), desc[0]) + ' '
-        return s3
+        s1 = ''.join(Encounter.__build_column__(name, desc[0]) + ' ' for name, desc in Encounter.fieldnames.items())
+        s2 = ''.join(Encounter.__build_column__(desc[1], desc[0]) + ' ' for name, desc in Encounter.fieldnames.items())
+        s3 = ''.join(Encounter.__build_column__(getattr(self, desc[2]), desc[0]) + ' ' for name, desc in Encounter.fieldnames.items()
+                     if name != 'Admit Time' and name != 'Arr Time' and name != 'Disch Time')
+        return '\n' + s1 + '\n' + s2 + '\n' + s3
 
     def __repr__(self):
         return self.__str__()
@@ -126,12 +137,19 @@ class Encounter:
     def __setattr__(self, key, value):
         if key == 'har' or key == 'admit_datetime':
             raise AttributeError('Attributes "har" and "admit_datetime" are immutable.')
-        self.__dict__[key] = value
+        object.__setattr__(self, key, value)
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in Encounter.__slots__ if hasattr(self, attr)}
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            object.__setattr__(self, attr, value)
 
     def csv_rows(self, events) -> dict:
         row = {}
         for name, desc in Encounter.fieldnames.items():
-            attr = self.__getattribute__(desc[2])
+            attr = getattr(self, desc[2])
             if name == 'Admit Date' or name == 'Arr Date' or name == 'Disch Date':
                 row[name] = '<NA>' if attr is None else datetime.strftime(attr, '%m/%d/%Y')
             elif name == 'Admit Time' or name == 'Arr Time' or name == 'Disch Time':
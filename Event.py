@@ -1,10 +1,14 @@
 
 from datetime import datetime
+import sys
 from Encounter import Encounter
 
 
 class Event:
 
+    # Events are stored in slots rather than an instance dict to keep large datasets small
+    __slots__ = ('ID', 'evt_type', 'eff_date', 'from_unit', 'to_unit', 'user', 'from_class', 'to_class', 'location')
+
     # A list of all possible event types
     evt_types = frozenset(['Admission',
                            'Discharge',
@@ -26,15 +30,20 @@ class Event:
                   'Location': (16, '--------', 'location')
                   }
 
-    def __init__(self, csv_row: dict, dept_synonyms: dict):
+    def __init__(self, csv_row: dict, dept_synonyms: dict, fields: frozenset = None):
 
         for name, desc in Event.fieldnames.items():
 
             attr = desc[2]
 
+            # when a set of attribute names is given, skip parsing the fields that are not in it
+            if fields is not None and attr not in fields:
+                object.__setattr__(self, attr, None)
+                continue
+
             # every event must have a unique id number
             if name == 'Event ID':
-                self.__dict__[attr] = int(csv_row[name])
+                object.__setattr__(self, attr, int(csv_row[name]))
 
             # every event must have an effective date and time
             elif name == 'Eff Date':
@@ -45,7 +54,7 @@ class Event:
                     y = datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p')
                 except BaseException:
                     y = datetime.strptime(x, '%m/%d/%Y %I:%M %p')
-                self.__dict__[attr] = y
+                object.__setattr__(self, attr, y)
 
             # skip the effective time, which is already handled above
             elif name == 'Eff Time':
@@ -61,7 +70,7 @@ class Event:
                         x = t
                         break
                 if x:
-                    self.__dict__[attr] = x
+                    object.__setattr__(self, attr, x)
                 else:
                     raise ValueError('Invalid event type detected.')
 
@@ -73,17 +82,28 @@ class Event:
                 # names for a department but a single standard name is needed for processing.
                 y = dept_synonyms.get(x, x)
                 try:
-                    self.__dict__[attr] = y
+                    object.__setattr__(self, attr, sys.intern(y))
                 except BaseException:
                     raise KeyError('dict object passed to Event.__init__() does not contain all required fields.')
 
             # all other required fields are simple strings
             else:
                 try:
-                    self.__dict__[attr] = csv_row[name].strip()
+                    object.__setattr__(self, attr, sys.intern(csv_row[name].strip()))
                 except BaseException:
                     raise KeyError('dict object passed to Event.__init__() does not contain all required fields.')
 
+    @classmethod
+    def from_attributes(cls, attributes: dict):
+        '''
+        Builds an Event directly from already parsed attribute values, keyed by the
+        attribute names in Event.fieldnames, bypassing the csv row parsing in __init__().
+        '''
+        event = cls.__new__(cls)
+        for attr, value in attributes.items():
+            object.__setattr__(event, attr, value)
+        return event
+
     def __eq__(self, other):
         return self.ID == other.ID
 
@@ -106,11 +126,7 @@ class Event:
         return self.ID
 
     def __str__(self):
-        s = ''
-        for name, desc in Event.fieldnames.items():
-            if name != 'Eff Time':
-                s += Event.__build_column__(self.__getattribute__(desc[2]), desc[0]) + ' '
-        return s
+        return ''.join(Event.__build_column__(getattr(self, desc[2]), desc[0]) + ' ' for name, desc in Event.fieldnames.items() if name != 'Eff Time')
 
     def __repr__(self):
         return self.__str__()
@@ -118,12 +134,19 @@ class Event:
     def __setattr__(self, key, value):
         if key == 'ID':
             raise AttributeError('Attribute "ID" is immutable.')
-        self.__dict__[key] = value
+        object.__setattr__(self, key, value)
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in Event.__slots__ if hasattr(self, attr)}
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            object.__setattr__(self, attr, value)
 
     def get_csv_row(self) -> dict:
         row = {}
         for name, desc in Event.fieldnames.items():
-            attr = self.__getattribute__(desc[2])
+            attr = getattr(self, desc[2])
             if name == 'Eff Date':
                 row[name] = datetime.strftime(attr, '%m/%d/%Y')
             elif name == 'Eff Time':
@@ -135,21 +158,12 @@ class Event:
     @staticmethod
     def __build_column__(value, width):
         value = datetime.strftime(value, '%m/%d/%Y %I:%M %p') if isinstance(value, datetime) else str(value)
-        length = len(value)
-        value = value[0:min(width, length)]
-        for i in range(0, width - length):
-            value += ' '
-        return value
+        return value[0:width].ljust(width)
 
     @classmethod
     def build_event_table_str(cls, events: list, encounter: Encounter = None) -> str:
-        s1 = ''
-        s2 = ''
-        for name, desc in cls.fieldnames.items():
-            if name != 'Eff Time':
-                s1 += cls.__build_column__(name, desc[0]) + ' '
-                s2 += cls.__build_column__(desc[1], desc[0]) + ' '
-        s3 = str(encounter) + '\n' + s1 + '\n' + s2 + '\n'
-        for event in events:
-            s3 += str(event) + '\n'
-        return s3
+        columns = [(name, desc) for name, desc in cls.fieldnames.items() if name != 'Eff Time']
+        s1 = ''.join(cls.__build_column__(name, desc[0]) + ' ' for name, desc in columns)
+        s2 = ''.join(cls.__build_column__(desc[1], desc[0]) + ' ' for name, desc in columns)
+        rows = ''.join(str(event) + '\n' for event in events)
+        return str(encounter) + '\n' + s1 + '\n' + s2 + '\n' + rows
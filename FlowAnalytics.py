@@ -0,0 +1,142 @@
+from PatientCensus import _column_codes
+import pandas as pd
+import numpy as np
+import calendar
+
+# the default length of stay histogram bins, in hours
+default_los_bins = [0, 4, 8, 12, 24, 48, 72, 96, 120, 168, 336, np.inf]
+
+
+class FlowAnalytics:
+    '''
+    Patient flow statistics of the stays DataFrame from PatientStays.build_dataset(): unit to unit
+    transition matrices, length of stay histograms and percentiles, and hour-of-week arrival and
+    departure rates. Each statistic is computed in a single vectorized pass over the integer codes
+    of the stays and cached by its arguments, so asking the same question again returns the cached
+    table without touching the stays. The cached tables are shared, so copy one before changing it,
+    and call clear() if the stays themselves are changed.
+
+    start_date and end_date bound the hour-of-week rates and default to the first start and the
+    last end of the stays.
+    '''
+
+    def __init__(self, stays: pd.DataFrame, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None):
+        self.stays = stays
+        self.start_date = pd.Timestamp(stays['start'].min() if start_date is None else start_date)
+        self.end_date = pd.Timestamp(stays['end'].max() if end_date is None else end_date)
+        self.__cache = {}
+
+    def clear(self) -> None:
+        self.__cache.clear()
+
+    def __cached(self, key: tuple, compute):
+        result = self.__cache.get(key, None)
+        if result is None:
+            result = self.__cache[key] = compute()
+        return result
+
+    def __codes(self, column: str) -> tuple:
+        return self.__cached(('codes', column), lambda: _column_codes(self.stays[column]))
+
+    def __status_mask(self, exclude: str) -> np.ndarray:
+        return self.__cached(('status', exclude), lambda: (self.stays['status'] != exclude).to_numpy())
+
+    def __complete(self) -> np.ndarray:
+        return self.__cached(('complete',), lambda: (self.stays['status'] == 'Patient stay is complete').to_numpy())
+
+    def transition_matrix(self, source: str = 'unit', target: str = 'went_to', complete_only: bool = True, normalize: bool = False) -> pd.DataFrame:
+        '''
+        Counts the stays from each value of source (rows) to each value of target (columns), by default
+        from each unit to the unit or discharge disposition the patient went to next. Stays that were
+        still in-house at the end date have no known destination and are left out when complete_only
+        is True. When normalize is True, each row holds the fraction of the stays of its unit instead.
+        '''
+        def compute() -> pd.DataFrame:
+            sources, s = self.__codes(source)
+            targets, t = self.__codes(target)
+            keep = (s >= 0) & (t >= 0)
+            if complete_only:
+                keep &= self.__complete()
+            counts = np.bincount(s[keep] * len(targets) + t[keep], minlength=len(sources) * len(targets))
+            counts = counts.reshape(len(sources), len(targets))
+            rows = counts.sum(axis=1) > 0
+            cols = counts.sum(axis=0) > 0
+            matrix = pd.DataFrame(counts[rows][:, cols], index=pd.Index(np.array(sources, dtype=object)[rows], name=source),
+                                  columns=pd.Index(np.array(targets, dtype=object)[cols], name=target))
+            return matrix.div(matrix.sum(axis=1), axis=0) if normalize else matrix
+        return self.__cached(('transitions', source, target, complete_only, normalize), compute)
+
+    def los_histogram(self, column: str = 'unit', bins: list = default_los_bins, complete_only: bool = True) -> pd.DataFrame:
+        '''
+        Counts the stays of each value of column by length of stay in hours, with one column per [left, right)
+        bin of bins. Stays cut off at the start or end date are left out when complete_only is True.
+        '''
+        def compute() -> pd.DataFrame:
+            groups, g = self.__codes(column)
+            edges = np.asarray(bins, dtype=np.float64)
+            b = np.searchsorted(edges, self.stays['hours'].to_numpy(dtype=np.float64), side='right') - 1
+            keep = (g >= 0) & (b >= 0) & (b < len(edges) - 1)
+            if complete_only:
+                keep &= self.__complete()
+            counts = np.bincount(g[keep] * (len(edges) - 1) + b[keep], minlength=len(groups) * (len(edges) - 1))
+            return pd.DataFrame(counts.reshape(len(groups), len(edges) - 1), index=pd.Index(groups, name=column),
+                                columns=pd.IntervalIndex.from_breaks(edges, closed='left', name='hours'))
+        return self.__cached(('los_histogram', column, tuple(bins), complete_only), compute)
+
+    def los_percentiles(self, column: str = 'unit', percentiles: list = [50, 75, 90, 95], complete_only: bool = True) -> pd.DataFrame:
+        '''
+        The count, mean and percentiles of the length of stay in hours of each value of column, interpolated
+        the same way as numpy.percentile(). Stays cut off at the start or end date are left out when
+        complete_only is True.
+        '''
+        def compute() -> pd.DataFrame:
+            groups, g = self.__codes(column)
+            hours = self.stays['hours'].to_numpy(dtype=np.float64)
+            keep = g >= 0
+            if complete_only:
+                keep &= self.__complete()
+            g, hours = g[keep], hours[keep]
+            order = np.lexsort((hours, g))
+            g, hours = g[order], hours[order]
+            counts = np.bincount(g, minlength=len(groups))
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            found = counts > 0
+            result = pd.DataFrame({'count': counts}, index=pd.Index(groups, name=column))
+            result['mean'] = np.bincount(g, weights=hours, minlength=len(groups)) / np.where(found, counts, 1)
+            for p in percentiles:
+                position = (counts - 1).clip(0) * (p / 100)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.minimum(lower + 1, (counts - 1).clip(0))
+                a = hours[np.where(found, starts + lower, 0)] if len(hours) > 0 else np.zeros(len(groups))
+                b = hours[np.where(found, starts + upper, 0)] if len(hours) > 0 else np.zeros(len(groups))
+                result[p] = np.where(found, a + (b - a) * (position - lower), np.nan)
+            return result[found]
+        return self.__cached(('los_percentiles', column, tuple(percentiles), complete_only), compute)
+
+    def hour_of_week_rates(self, column: str = 'unit', event: str = 'arrivals') -> pd.DataFrame:
+        '''
+        The average number of arrivals to, or departures from, each value of column during each hour of the
+        week between start_date and end_date, with one row per (Weekday, Hour) in calendar order. Arrivals are
+        the starts of the stays that were not already in-house at the start date, and departures are the ends
+        of the stays that were not still in-house at the end date.
+        '''
+        if event not in ('arrivals', 'departures'):
+            raise ValueError('event must be "arrivals" or "departures".')
+
+        def compute() -> pd.DataFrame:
+            groups, g = self.__codes(column)
+            if event == 'arrivals':
+                times = pd.DatetimeIndex(self.stays['start'])
+                keep = self.__status_mask('In-house as of start date')
+            else:
+                times = pd.DatetimeIndex(self.stays['end'])
+                keep = self.__status_mask('In-house as of end date')
+            keep = keep & (g >= 0) & (times >= self.start_date) & (times < self.end_date)
+            slots = times.dayofweek.to_numpy() * 24 + times.hour.to_numpy()
+            counts = np.bincount(slots[keep] * len(groups) + g[keep], minlength=168 * len(groups)).reshape(168, len(groups))
+            hours = pd.date_range(self.start_date.floor('h'), self.end_date, freq='h', inclusive='left')
+            occurrences = np.bincount(hours.dayofweek * 24 + hours.hour, minlength=168)
+            rates = pd.DataFrame(counts / np.where(occurrences > 0, occurrences, 1)[:, None], columns=groups)
+            rates.index = pd.MultiIndex.from_product([list(calendar.day_name), range(24)], names=['Weekday', 'Hour'])
+            return rates
+        return self.__cached(('hour_of_week', column, event), compute)
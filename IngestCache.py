@@ -0,0 +1,81 @@
+from Encounter import Encounter
+from Event import Event
+import hashlib
+import pickle
+import os
+
+
+class IngestCache:
+    '''
+    An on-disk cache of parsed ADT download files, used by AdtEvents.read_from_csv().
+
+    Each entry holds the (encounter -> event set dict, min eff date, max eff date) tuple parsed
+    from one file, pickled under a key built from the file's absolute path, size and modification
+    time, plus a fingerprint of Event.fieldnames, Encounter.fieldnames, Event.evt_types and the
+    dept_synonyms used to parse it. Changing any of those produces a different key, so stale
+    entries are never read and are eventually removed by evict(), which deletes the least
+    recently used entries until the cache fits in max_bytes.
+    '''
+
+    # bump this whenever the pickled layout of a cache entry changes
+    version = 1
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024**3):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def schema_fingerprint(dept_synonyms: dict) -> str:
+        h = hashlib.sha1()
+        h.update(repr(IngestCache.version).encode())
+        h.update(repr(list(Event.fieldnames.items())).encode())
+        h.update(repr(list(Encounter.fieldnames.items())).encode())
+        h.update(repr(sorted(Event.evt_types)).encode())
+        h.update(repr(sorted(dept_synonyms.items())).encode())
+        return h.hexdigest()
+
+    def path_for(self, file: str, dept_synonyms: dict) -> str:
+        stat = os.stat(file)
+        h = hashlib.sha1()
+        h.update(os.path.abspath(file).encode())
+        h.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        h.update(IngestCache.schema_fingerprint(dept_synonyms).encode())
+        return os.path.join(self.directory, h.hexdigest() + '.pickle')
+
+    def load(self, file: str, dept_synonyms: dict):
+        '''Returns the cached result for file, or None if it has not been cached.'''
+        path = self.path_for(file, dept_synonyms)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return result
+
+    def store(self, file: str, dept_synonyms: dict, result: tuple) -> None:
+        path = self.path_for(file, dept_synonyms)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+    def evict(self) -> None:
+        '''Deletes the least recently used entries until the cache is no larger than max_bytes.'''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.directory, name))
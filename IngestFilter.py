@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from Encounter import Encounter
+from Event import Event
+import csv
+
+
+class IngestFilter:
+    '''
+    Selects the rows and fields of the ADT download files that AdtEvents.read_from_csv() loads, so a
+    targeted report does not pay for parsing a whole multi-year extract set. Rows are tested on their
+    raw text, and rows that are not needed are skipped before any datetime parsing or object construction.
+
+    start_date, end_date:   only events effective in [start_date, end_date) are loaded, and the EventDataset
+                            covers exactly that range, as if it came from an extract of that period.
+    units:                  only encounters with a loaded event from or to one of these units, after
+                            dept_synonyms are applied, are loaded. All of their events are kept so their
+                            stays can still be built; filter the stays by unit for the report itself.
+    pt_classes:             only encounters whose patient class, or the class of a loaded event, is one
+                            of these are loaded.
+    evt_types:              only events of these types from Event.evt_types are loaded. Building stays
+                            needs every type, so this is meant for reports that count events.
+    fields:                 Encounter and Event attribute names to load in addition to the ones that
+                            PatientStays needs. The others are left as None. None loads every field.
+
+    Encounter selection by units or pt_classes reads only the unit and class columns of every file
+    once before the files are parsed.
+    '''
+
+    # the attributes that PatientStays.build_dataset() uses, which are always loaded
+    encounter_required = frozenset(['har', 'admit_datetime', 'arrival_datetime', 'disch_disp', 'disch_class'])
+    event_required = frozenset(['ID', 'evt_type', 'eff_date', 'from_unit', 'to_unit', 'from_class', 'to_class'])
+
+    def __init__(self, start_date: datetime = None, end_date: datetime = None, units: list = None, pt_classes: list = None,
+                 evt_types: list = None, fields: list = None):
+        if evt_types is not None and not set(evt_types).issubset(Event.evt_types):
+            raise ValueError(f'Event types must be in {sorted(Event.evt_types)}.')
+        self.start_date = start_date
+        self.end_date = end_date
+        self.units = None if units is None else frozenset(units)
+        self.pt_classes = None if pt_classes is None else frozenset(pt_classes)
+        self.evt_types = None if evt_types is None else frozenset(evt_types)
+        self.encounter_fields = None if fields is None else frozenset(fields) | IngestFilter.encounter_required
+        self.event_fields = None if fields is None else frozenset(fields) | IngestFilter.event_required
+        self.hars = None
+
+    def __row_test(self, header: list):
+        # Returns a function that tests the raw values of a csv row against the date and event type
+        # filters. Each distinct date and event type string is only converted once.
+        column = {name: i for i, name in enumerate(header)}
+        eff_date = column['Eff Date']
+        evt_type = column['Event Type']
+        first_day = None if self.start_date is None else self.start_date.date()
+        last_day = None if self.end_date is None else (self.end_date - timedelta(microseconds=1)).date()
+        days = {}
+        types = {}
+
+        def in_range(value: str) -> bool:
+            keep = days.get(value, None)
+            if keep is None:
+                day = datetime.strptime(value.strip(), '%m/%d/%Y').date()
+                keep = days[value] = (first_day is None or day >= first_day) and (last_day is None or day <= last_day)
+            return keep
+
+        def is_selected_type(value: str) -> bool:
+            keep = types.get(value, None)
+            if keep is None:
+                folded = value.strip().casefold()
+                keep = types[value] = False
+                # the first matching type is the one Event.__init__() assigns
+                for t in Event.evt_types:
+                    if t.casefold() in folded:
+                        keep = types[value] = t in self.evt_types
+                        break
+            return keep
+
+        tests = []
+        if first_day is not None or last_day is not None:
+            tests.append(lambda values: in_range(values[eff_date]))
+        if self.evt_types is not None:
+            tests.append(lambda values: is_selected_type(values[evt_type]))
+        return lambda values: all(test(values) for test in tests)
+
+    def select_encounters(self, filenames: list, dept_synonyms: dict) -> None:
+        '''
+        Finds the HARs of the encounters that have a row matching units and pt_classes by reading only
+        the columns those filters need. Called by read_from_csv() before the files are parsed.
+        '''
+        if self.units is None and self.pt_classes is None:
+            return
+        self.hars = set()
+        for file in filenames:
+            with open(file, 'r', newline='') as csvfile:
+                reader = csv.reader(csvfile)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                column = {name: i for i, name in enumerate(header)}
+                har = column['HAR']
+                from_unit, to_unit = column['From Unit'], column['To Unit']
+                classes = [column['Pt Class'], column['From Class'], column['To Class']]
+                row_test = self.__row_test(header)
+                for values in reader:
+                    if self.units is not None:
+                        x = values[from_unit].strip()
+                        y = values[to_unit].strip()
+                        if dept_synonyms.get(x, x) not in self.units and dept_synonyms.get(y, y) not in self.units:
+                            continue
+                    if self.pt_classes is not None and not any(values[i].strip() in self.pt_classes for i in classes):
+                        continue
+                    if row_test(values):
+                        self.hars.add(int(values[har]))
+
+    def rows(self, csvfile):
+        '''Yields the rows of an open csv file that pass the filters as dicts.'''
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return
+        har = header.index('HAR')
+        row_test = self.__row_test(header)
+        for values in reader:
+            if (self.hars is None or int(values[har]) in self.hars) and row_test(values):
+                yield dict(zip(header, values))
+
+    def keep_event(self, event: Event) -> bool:
+        # rows are first selected by day, so check the exact time of the effective date as well
+        return (self.start_date is None or event.eff_date >= self.start_date) and (self.end_date is None or event.eff_date < self.end_date)
+
+    def keep_encounter(self, encounter: Encounter, event_set: set) -> bool:
+        # HARs are selected before parsing, so check the encounter itself once its events are known
+        if self.units is not None and not any(e.from_unit in self.units or e.to_unit in self.units for e in event_set):
+            return False
+        if self.pt_classes is not None and encounter.disch_class not in self.pt_classes and \
+                not any(e.from_class in self.pt_classes or e.to_class in self.pt_classes for e in event_set):
+            return False
+        return True
+
+    def filter_file_result(self, result: tuple) -> tuple:
+        '''Applies the filters to a file that was already parsed in full, such as one loaded from an IngestCache.'''
+        dataset = {}
+        for encounter, event_set in result[0].items():
+            if self.hars is not None and encounter.har not in self.hars:
+                continue
+            kept = {e for e in event_set if self.keep_event(e) and (self.evt_types is None or e.evt_type in self.evt_types)}
+            if kept:
+                dataset[encounter] = kept
+        eff_dates = [e.eff_date for event_set in dataset.values() for e in event_set]
+        return dataset, min(eff_dates, default=None), max(eff_dates, default=None)
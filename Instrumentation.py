@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import tracemalloc
+import cProfile
+import time
+import json
+import uuid
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux and the other BSDs
+_maxrss_scale = 1 if sys.platform == 'darwin' else 1024
+
+
+class Instrumentation:
+    '''
+    Records the wall time, CPU time and memory of each stage of a pipeline run as json lines.
+
+    Use stage() as a context manager, or timed() as a decorator. The record yielded by stage() is a
+    dict that the caller can add counts to, for example the stats filled in by
+    AdtEvents.read_from_csv(stats=...) or PatientStays.build_dataset(stats=...).
+
+    output:         a file path to append the records to, or a file-like object, or None to only keep
+                    them in self.records.
+    trace_memory:   measure the peak bytes allocated during each stage with tracemalloc. This slows the
+                    run down, so by default only the process's maximum resident set size is recorded.
+    profile_stages: names of stages to run under cProfile. Their stats are saved to
+                    <profile_dir>/<run id>-<stage>.prof and can be read with pstats.
+    '''
+
+    def __init__(self, output=None, trace_memory: bool = False, profile_stages: list = [], profile_dir: str = '.', run_id: str = None):
+        self.output = output
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+        self.run_id = run_id if run_id else uuid.uuid4().hex[:12]
+        self.records = []
+        self.__peaks = []
+        self.__started_tracing = False
+
+    def emit(self, record: dict) -> None:
+        self.records.append(record)
+        if self.output is None:
+            return
+        line = json.dumps(record, default=str) + '\n'
+        if isinstance(self.output, str):
+            with open(self.output, 'a') as f:
+                f.write(line)
+        else:
+            self.output.write(line)
+            self.output.flush()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        record = {'run': self.run_id, 'stage': name, 'started': datetime.now().isoformat(timespec='milliseconds')}
+        record.update(fields)
+        profiler = cProfile.Profile() if name in self.profile_stages else None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.__started_tracing = True
+            if self.__peaks:
+                # remember the peak of the enclosing stage before resetting it for this one
+                self.__peaks[-1] = max(self.__peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.__peaks.append(0)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                record['profile'] = os.path.join(self.profile_dir, f'{self.run_id}-{name}.prof')
+                profiler.dump_stats(record['profile'])
+            record['wall_seconds'] = round(time.perf_counter() - wall, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu, 6)
+            if self.trace_memory:
+                peak = max(self.__peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['peak_bytes'] = peak
+                if self.__peaks:
+                    self.__peaks[-1] = max(self.__peaks[-1], peak)
+                elif self.__started_tracing:
+                    # leave tracemalloc running if it was started before the first stage
+                    tracemalloc.stop()
+                    self.__started_tracing = False
+            if resource is not None:
+                record['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _maxrss_scale
+            self.emit(record)
+
+    def timed(self, name: str = None):
+        '''Decorator that runs every call of the decorated function as a stage.'''
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name if name else func.__qualname__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+from PatientStays import Stay, _encounter_stays
+from PatientCensus import patient_hours, bin_width_of, _timestamp_columns
+from Encounter import Encounter
+from Event import Event
+import pandas as pd
+import numpy as np
+import time
+import csv
+
+# Keeps the census up to date from ADT events that arrive one at a time, for example from a csv
+# file that the interface engine appends to, or from a queue. Each event only re-runs the stay
+# cleanup and validation rules of PatientStays for its own encounter, so the time it takes does
+# not depend on how much history has been received.
+
+# the end date given to the stay builder, so the last stay of an encounter that is in-house stays open
+_in_house = datetime.max
+
+
+class LiveCensus:
+    '''
+    Maintains the stays of every encounter and the current and binned census as ADT events arrive.
+
+    start_date:     the start of the census. Patients admitted before it are counted from it.
+    dept_synonyms:  the same unit name mapping given to AdtEvents.read_from_csv().
+    column:         the Stay field that the census is counted by.
+    freq:           the width of the census bins, hourly by default.
+
+    An encounter whose events are invalid, for example because an event is missing or arrives late,
+    is left out of the census and kept in self.invalid until a later event makes it valid again.
+    Rows that cannot be parsed are kept in self.rejected with the error they raised.
+    '''
+
+    def __init__(self, start_date: datetime, dept_synonyms: dict = {}, column: str = 'unit', freq: str = 'h'):
+        self.start_date = start_date
+        self.dept_synonyms = dept_synonyms
+        self.column = column
+        self.freq = freq
+        self.now = start_date
+        self.invalid = {}
+        self.rejected = []
+        self.__field = Stay._fields.index(column)
+        self.__width = timedelta(microseconds=int(bin_width_of(freq)) // 1000)
+        self.__encounters = {}  # encounter -> [latest encounter, set of events, list of stays]
+        self.__open = {}        # encounter -> the stay that is still open
+        self.__closed = {}      # bin number -> {column value: microseconds of patient time}
+
+    def __add_time(self, group, start: datetime, end: datetime, sign: int) -> None:
+        start = max(start, self.start_date)
+        if end <= start:
+            return
+        k = (start - self.start_date) // self.__width
+        bin_start = self.start_date + k * self.__width
+        while bin_start < end:
+            bin_end = bin_start + self.__width
+            microseconds = (min(end, bin_end) - max(start, bin_start)) // timedelta(microseconds=1)
+            groups = self.__closed.setdefault(k, {})
+            groups[group] = groups.get(group, 0) + sign * microseconds
+            k += 1
+            bin_start = bin_end
+
+    def __apply(self, encounter: Encounter, stay: Stay, sign: int) -> None:
+        if stay.end == _in_house:
+            if sign > 0:
+                self.__open[encounter] = stay
+            elif self.__open.get(encounter) == stay:
+                del self.__open[encounter]
+        else:
+            self.__add_time(stay[self.__field], stay.start, stay.end, sign)
+
+    def add_event(self, encounter: Encounter, event: Event) -> None:
+        '''Adds an event to its encounter and updates the encounter's stays and the census.'''
+        entry = self.__encounters.get(encounter)
+        if entry is None:
+            entry = self.__encounters[encounter] = [encounter, set(), []]
+        else:
+            # the latest row has the latest discharge information
+            entry[0] = encounter
+        entry[1].add(event)
+        if event.eff_date > self.now:
+            self.now = event.eff_date
+        invalid = []
+        stays = _encounter_stays(entry[0], entry[1], self.start_date, _in_house, None, invalid)
+        if invalid:
+            self.invalid[encounter] = invalid[0]
+        else:
+            self.invalid.pop(encounter, None)
+        old = set(entry[2])
+        new = set(stays)
+        for stay in old - new:
+            self.__apply(encounter, stay, -1)
+        for stay in new - old:
+            self.__apply(encounter, stay, 1)
+        entry[2] = stays
+
+    def add_row(self, csv_row: dict) -> bool:
+        '''Parses a row with the columns of the ADT download files and adds its event. Returns False if the row was rejected.'''
+        try:
+            encounter = Encounter(csv_row)
+            event = Event(csv_row, self.dept_synonyms)
+        except (ValueError, KeyError, TypeError) as e:
+            self.rejected.append((csv_row, e))
+            return False
+        self.add_event(encounter, event)
+        return True
+
+    def consume(self, rows, callback=None) -> int:
+        '''
+        Adds every row from an iterable such as tail_csv() or iter_queue() and returns the number of rows
+        that were added. callback, if given, is called with this object after each row.
+        '''
+        count = 0
+        for row in rows:
+            count += self.add_row(row)
+            if callback:
+                callback(self)
+        return count
+
+    def advance(self, now: datetime) -> None:
+        '''Moves the clock forward when time passes without any events, so open stays keep counting.'''
+        if now > self.now:
+            self.now = now
+
+    def retire(self, before: datetime) -> int:
+        '''
+        Forgets the events of discharged encounters whose last stay ended before the given date, keeping
+        their stays in the census. Late events for them will then start a new encounter. Returns the number retired.
+        '''
+        retired = [encounter for encounter, (latest, events, stays) in self.__encounters.items()
+                   if encounter not in self.__open and encounter not in self.invalid and all(stay.end < before for stay in stays)]
+        for encounter in retired:
+            del self.__encounters[encounter]
+        return len(retired)
+
+    def current(self) -> dict:
+        '''The number of patients in-house right now for each value of the census column.'''
+        counts = {}
+        for stay in self.__open.values():
+            if stay.start <= self.now:
+                counts[stay[self.__field]] = counts.get(stay[self.__field], 0) + 1
+        return counts
+
+    def stays(self) -> pd.DataFrame:
+        '''The stays of every encounter that has not been retired, with the open stays ending now.'''
+        data = []
+        for latest, events, stays in self.__encounters.values():
+            for stay in stays:
+                if stay.end == _in_house:
+                    stay = stay._replace(end=self.now, hours=(self.now - stay.start) / timedelta(hours=1))
+                data.append(stay)
+        return pd.DataFrame(data, columns=Stay._fields)
+
+    def census(self, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        '''
+        The census between start and end (default: from start_date up to now) with the same columns as
+        PatientCensus.build_DataFrame() built without any staffing models. Only the bins in the range are visited.
+        '''
+        first = 0 if start is None else max((start - self.start_date) // self.__width, 0)
+        if end is None:
+            end = self.now + self.__width
+        last = max(-((self.start_date - end) // self.__width), first)
+        timestamps = pd.date_range(self.start_date + first * self.__width, periods=last - first, freq=self.freq)
+        census = _timestamp_columns(timestamps)
+        groups = {}
+        for k in range(first, last):
+            for group in self.__closed.get(k, {}):
+                groups.setdefault(group, len(groups))
+        for stay in self.__open.values():
+            groups.setdefault(stay[self.__field], len(groups))
+        width = self.__width // timedelta(microseconds=1)
+        values = np.zeros((last - first, len(groups)), dtype=np.float64)
+        for k in range(first, last):
+            for group, microseconds in self.__closed.get(k, {}).items():
+                values[k - first, groups[group]] = microseconds / width
+        if self.__open:
+            bin_starts = timestamps.as_unit('ns').asi8
+            open_stays = list(self.__open.values())
+            starts = pd.DatetimeIndex([stay.start for stay in open_stays]).as_unit('ns').asi8
+            ends = np.full(len(open_stays), pd.Timestamp(self.now).as_unit('ns').value, dtype=np.int64)
+            codes = np.array([groups[stay[self.__field]] for stay in open_stays], dtype=np.int64)
+            values += patient_hours(bin_starts, np.int64(width * 1000), starts, ends, codes, len(groups)) / (width / 3.6e9)
+        census['Total Census'] = values.sum(axis=1)
+        return pd.concat([census, pd.DataFrame(values, index=census.index, columns=list(groups.keys()))], axis=1)
+
+
+def tail_csv(filename: str, follow: bool = True, poll_interval: float = 1.0, stop=None):
+    '''
+    Yields the rows of a csv file as dicts, then keeps yielding the rows that are appended to it, like tail -f.
+    A line is only read once its newline has been written. When follow is False, or when the callable stop
+    returns True while waiting, the generator returns at the end of the file.
+    '''
+    with open(filename, 'r', newline='') as f:
+        header = None
+        partial = ''
+        while True:
+            line = f.readline()
+            if line.endswith('\n'):
+                line = partial + line
+                partial = ''
+                values = next(csv.reader([line]), None)
+                if not values:
+                    continue
+                if header is None:
+                    header = values
+                else:
+                    yield dict(zip(header, values))
+            else:
+                partial += line
+                if not follow or (stop is not None and stop()):
+                    return
+                time.sleep(poll_interval)
+
+
+def iter_queue(events, sentinel=None):
+    '''Yields the rows put on a queue.Queue, or a multiprocessing queue, until the sentinel is received.'''
+    while True:
+        row = events.get()
+        if row is sentinel:
+            return
+        yield row
+
+
+# for testing
+if __name__ == '__main__':
+    import sys
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else './input files/live_feed.csv'
+    live = LiveCensus(datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=7))
+    print(f'Following "{filename}"...')
+
+    def show(live: LiveCensus) -> None:
+        print(live.now, live.current())
+
+    live.consume(tail_csv(filename), show)
@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from bisect import bisect_right
+from itertools import repeat
+import PatientStays as ps
+import PatientCensus as pc
+import AdtEvents as adt
+import pandas as pd
+import numpy as np
+
+# Builds the stays and the census of a long date range as a series of date partitions, such as
+# months or quarters, that are processed in parallel and merged. Every encounter is assigned to
+# the partition of its admission, and its stays are built against the dates of the whole range,
+# so a stay that crosses a partition boundary is kept whole instead of being split into
+# "In-house as of start date" and "In-house as of end date" stays. The census of each partition
+# then counts the part of every stay that falls within it. The merged results are the same as
+# PatientStays.build_dataset() followed by PatientCensus.build_DataFrame() over the full range.
+
+
+def date_partitions(start_date: datetime, end_date: datetime, freq: str = 'QS') -> list:
+    '''
+    Splits start_date to end_date into a list of (start, end) partitions at each period start of freq,
+    for example 'MS' for months or 'QS' for quarters. The first and last partitions may be partial.
+    '''
+    bounds = [b.to_pydatetime() for b in pd.date_range(start_date, end_date, freq=freq)]
+    edges = [start_date] + [b for b in bounds if start_date < b < end_date] + [end_date]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _partition_stays(positions: list, items: list, start_date: datetime, end_date: datetime, quarantine: bool) -> tuple:
+    # Builds the stays of the encounters of one partition inside a worker process. The position of
+    # each encounter in the dataset is returned with its stays so the partitions can be merged in order.
+    stays = []
+    stats = {}
+    invalid = []
+    for position, (encounter, event_set) in zip(positions, items):
+        found = [] if quarantine else None
+        stays.append((position, ps._encounter_stays(encounter, event_set, start_date, end_date, stats, found)))
+        if found:
+            invalid.append((position, found[0]))
+    return stays, stats, invalid
+
+
+def build_partitioned(dataset: adt.EventDataset, freq: str = 'QS', models: list = [], column: str = 'unit', census_freq: str = 'h',
+                      workers: int = None, stats: dict = None, quarantine: list = None) -> tuple:
+    '''
+    Returns the (stays, census) of a dataset, built one date partition of freq ('QS' for quarters by default,
+    'MS' for months) at a time in a pool of workers processes, one per CPU by default.
+
+    The stays have the same rows in the same order as PatientStays.build_dataset(dataset) and the census
+    has the same rows and columns as PatientCensus.build_DataFrame() over the dataset's start and end dates.
+    stats and quarantine work as in build_dataset(). The staffing models run once on the merged census.
+    '''
+    partitions = date_partitions(dataset.start_date, dataset.end_date, freq)
+    edges = [start for start, end in partitions[1:]]
+    positions = [[] for p in partitions]
+    items = [[] for p in partitions]
+    for position, item in enumerate(dataset.data.items()):
+        p = bisect_right(edges, item[0].admit_datetime)
+        positions[p].append(position)
+        items[p].append(item)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        # build the stays of each partition and put them back in the order of the dataset
+        ordered = [None] * len(dataset.data)
+        invalid = []
+        for found, partition_stats, partition_invalid in executor.map(_partition_stays, positions, items, repeat(dataset.start_date),
+                                                                      repeat(dataset.end_date), repeat(quarantine is not None)):
+            for position, encounter_stays in found:
+                ordered[position] = encounter_stays
+            invalid.extend(partition_invalid)
+            if stats is not None:
+                ps._add_stats(stats, partition_stats)
+        stays = ps.stays_frame([stay for encounter_stays in ordered for stay in encounter_stays], ps.build_dictionary(dataset))
+        if stats is not None:
+            ps._add_stats(stats, {'stays': len(stays)})
+        if quarantine is not None:
+            quarantine.extend(q for position, q in sorted(invalid, key=lambda x: x[0]))
+
+        # count the census of each partition from the stays that overlap it
+        census = pc._timestamp_columns(pd.date_range(start=dataset.start_date, end=dataset.end_date, freq=census_freq, inclusive='left'))
+        units, groups = pc._column_codes(stays[column])
+        bin_width = pc.bin_width_of(census_freq)
+        bin_starts = census['Timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        stay_starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        stay_ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        cuts = [0] + list(np.searchsorted(bin_starts, [pd.Timestamp(edge).as_unit('ns').value for edge in edges])) + [len(bin_starts)]
+        parts = []
+        for i, j in zip(cuts[:-1], cuts[1:]):
+            if i == j:
+                continue
+            keep = (stay_starts < bin_starts[j - 1] + bin_width) & (stay_ends > bin_starts[i])
+            parts.append((bin_starts[i:j], stay_starts[keep], stay_ends[keep], groups[keep]))
+        results = executor.map(pc.patient_hours, [p[0] for p in parts], repeat(bin_width), [p[1] for p in parts],
+                               [p[2] for p in parts], [p[3] for p in parts], repeat(len(units)))
+        hours = np.concatenate(list(results)) if parts else np.zeros((0, len(units)))
+
+    census = pc._add_census_columns(census, hours, units, bin_width)
+    if len(models) > 0:
+        pc._apply_staffing_models(census, stays, models, pc._overlaps_table(census, stays, bin_starts, bin_width, stay_starts, stay_ends))
+    return stays, census
+
+
+# for testing
+if __name__ == '__main__':
+    from xlsxutil import list_csv_files_in
+    import time
+
+    dept_synonyms = {'MEDA': 'MED A', 'Med A': 'MED A'}
+    print('Reading the ADT download files...')
+    events = adt.read_from_csv(list_csv_files_in('..\\data\\2021\\IAH\\Q2'), dept_synonyms)
+    start = time.perf_counter()
+    stays, census = build_partitioned(events, freq='MS')
+    print(f'Built {len(stays)} stays and {len(census)} census rows in {time.perf_counter() - start:.3f} s.')
+
+    print('Done!')
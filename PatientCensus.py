@@ -1,9 +1,14 @@
 
-import pandas as pd
-import AdtEvents as adt
+from __future__ import annotations
+from lazyutil import LazyModule
 import abc
 import os
 
+# pandas and numpy are only imported when a census is first built, so the staffing model
+# base classes can be imported on their own
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+
 
 class StaffingModel(abc.ABC):
 
@@ -24,83 +29,340 @@ class StaffingModel(abc.ABC):
         pass
 
 
-def build_DataFrame(start_date: pd.Timestamp, end_date: pd.Timestamp, stays: pd.DataFrame, models: list = [], column: str = 'unit') -> pd.DataFrame:
+class BatchStaffingModel(abc.ABC):
+    '''
+    A staffing model that receives the whole census at once instead of one (stay, hour) pair
+    at a time. build_DataFrame() accepts both StaffingModel and BatchStaffingModel objects.
+    '''
 
-    # binary search function to lookup an entry in the census list
-    def __lookup_census_index(date_list: pd.core.series.Series, date: pd.Timestamp) -> int:
-        low = 0
-        high = len(date_list) - 1
-        index = 0
-        while low <= high:
-            mid = (low + high + 1) // 2
-            if date_list[mid] <= date:
-                index = mid
-                low = mid + 1
-            elif date_list[mid] > date:
-                high = mid - 1
-        return index
+    @abc.abstractmethod
+    def initialize(self, census: pd.DataFrame) -> None:
+        pass
 
-    # create and initialize the census table
-    census = pd.DataFrame(data=pd.date_range(start=start_date, end=end_date, freq='h', closed='left'), columns=['Timestamp'])
-    census['Hour'] = [x.hour for x in census['Timestamp']]
-    census['Weekday'] = [x.day_name() for x in census['Timestamp']]
-    census['Total Census'] = 0.0
+    @abc.abstractmethod
+    def addVariableStaff(self, overlaps: pd.DataFrame, census: pd.DataFrame, stays: pd.DataFrame) -> None:
+        '''
+        overlaps is a long-form table with one row for every (stay, hour) pair that a StaffingModel
+        would receive, in the same order. Its columns are 'census' (an index label of census),
+        'stay' (an index label of stays) and 'hours' (the patient hours of the stay in that hour).
+        '''
+        pass
+
+    @abc.abstractmethod
+    def addFixedStaff(self, census: pd.DataFrame) -> None:
+        pass
+
+    @abc.abstractmethod
+    def finalize(self, census: pd.DataFrame) -> None:
+        pass
+
+
+def stay_hour_overlaps(bin_starts: np.ndarray, bin_width: np.int64, stay_starts: np.ndarray, stay_ends: np.ndarray) -> tuple:
+    '''
+    Returns three equal length arrays (stay positions, bin positions, patient hours) with one entry
+    for every bin from the one containing the start of each stay through the one containing its end.
+    Bins before the census range are clamped to the first bin, as build_DataFrame() always has.
+    All timestamps are int64 nanoseconds and bin_starts must be sorted.
+    '''
+    hour = np.float64(3600 * 10**9)
+    first = np.maximum(np.searchsorted(bin_starts, stay_starts, side='right') - 1, 0)
+    last = np.maximum(np.searchsorted(bin_starts, stay_ends, side='right') - 1, 0) + 1
+    counts = np.maximum(np.minimum(last, len(bin_starts)) - first, 0)
+    stay_pos = np.repeat(np.arange(len(stay_starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bin_pos = first[stay_pos] + offsets
+    y = np.maximum(bin_starts[bin_pos], stay_starts[stay_pos])
+    z = np.minimum(bin_starts[bin_pos] + bin_width, stay_ends[stay_pos])
+    hours = np.where(y > z, 0, z - y) / hour
+    return stay_pos, bin_pos, hours
+
+
+def patient_hours(bin_starts: np.ndarray, bin_width: np.int64, stay_starts: np.ndarray, stay_ends: np.ndarray, groups: np.ndarray, group_count: int) -> np.ndarray:
+    '''
+    Distributes the length of each stay over a series of equal width time bins and returns a
+    (len(bin_starts), group_count) array of the patient hours in each bin for each group.
+
+    bin_starts, stay_starts, and stay_ends are int64 nanosecond timestamps and bin_starts must be
+    sorted and evenly spaced by bin_width. groups holds the column number of each stay.
+    The partial first and last bins of each stay are added directly, and the whole bins in between
+    are added with a difference array that is summed once at the end, so the cost does not depend
+    on the length of the stays.
+    '''
+    bin_count = len(bin_starts)
+    census = np.zeros((bin_count + 1, group_count), dtype=np.float64)
+    if bin_count == 0 or len(stay_starts) == 0:
+        return census[:bin_count]
+    hour = np.float64(3600 * 10**9)
+    t0 = bin_starts[0]
+    s = np.clip(stay_starts - t0, 0, bin_count * bin_width)
+    e = np.clip(stay_ends - t0, 0, bin_count * bin_width)
+    keep = (e > s) & (groups >= 0)
+    s, e, groups = s[keep], e[keep], groups[keep]
+    i = s // bin_width
+    j = e // bin_width
+    same = i == j
+
+    # stays that start and end within a single bin
+    np.add.at(census, (i[same], groups[same]), (e[same] - s[same]) / hour)
+
+    # the partial first and last bins of the remaining stays
+    i, j, s, e, g = i[~same], j[~same], s[~same], e[~same], groups[~same]
+    np.add.at(census, (i, g), ((i + 1) * bin_width - s) / hour)
+    np.add.at(census, (j, g), (e - j * bin_width) / hour)
+
+    # the whole bins in between
+    diff = np.zeros((bin_count + 1, group_count), dtype=np.float64)
+    np.add.at(diff, (i + 1, g), bin_width / hour)
+    np.add.at(diff, (j, g), -bin_width / hour)
+    census += np.cumsum(diff, axis=0)
+    return census[:bin_count]
+
+
+def bin_width_of(freq) -> np.int64:
+    '''The width in nanoseconds of a fixed frequency such as 'h', '15min' or '5min'.'''
+    width = pd.Timedelta(pd.tseries.frequencies.to_offset(freq))
+    if width <= pd.Timedelta(0):
+        raise ValueError(f'"{freq}" is not a fixed, positive frequency.')
+    return np.int64(width.value)
+
+
+def _timestamp_columns(timestamps: pd.DatetimeIndex) -> pd.DataFrame:
+    census = pd.DataFrame(data=timestamps, columns=['Timestamp'])
+    census['Hour'] = census['Timestamp'].dt.hour.astype('int64')
+    census['Weekday'] = census['Timestamp'].dt.day_name()
     census.index.name = 'Id'
-    for h in set(stays[column]):
-        census[h] = 0.0
+    return census
+
 
+def _column_codes(values: pd.Series) -> tuple:
+    # Returns the distinct values of a stays column and the column number of each stay. Categorical
+    # columns, such as the ones from PatientStays.build_dataset(), already hold codes, so only their
+    # unused categories are dropped.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        return list(values.cat.categories), values.cat.codes.to_numpy(dtype=np.int64)
+    codes, uniques = pd.factorize(values)
+    return list(uniques), codes.astype(np.int64)
+
+
+def _add_census_columns(census: pd.DataFrame, hours: np.ndarray, units: list, bin_width: np.int64) -> pd.DataFrame:
+    # Adds the 'Total Census' and unit columns to a table from _timestamp_columns(), given the patient hours in each bin
+    if bin_width != 3600 * 10**9:
+        hours /= bin_width / np.float64(3600 * 10**9)
+    census['Total Census'] = hours.sum(axis=1)
+    return pd.concat([census, pd.DataFrame(hours, index=census.index, columns=units)], axis=1)
+
+
+def _overlaps_table(census: pd.DataFrame, stays: pd.DataFrame, bin_starts: np.ndarray, bin_width: np.int64, stay_starts: np.ndarray, stay_ends: np.ndarray) -> pd.DataFrame:
+    # The (census row, stay, hours) table that staffing models receive in addVariableStaff()
+    stay_pos, bin_pos, hours = stay_hour_overlaps(bin_starts, bin_width, stay_starts, stay_ends)
+    return pd.DataFrame({'census': census.index[bin_pos], 'stay': stays.index[stay_pos], 'hours': hours})
+
+
+def _apply_staffing_models(census: pd.DataFrame, stays: pd.DataFrame, models: list, overlaps: pd.DataFrame) -> None:
     # initialize the staffing models
     for model in models:
         model.initialize(census)
-    one_hour = pd.Timedelta(hours=1)
-
-    # calculate the census and the variable staffing
-    for s in stays.index:
-        stay_start = stays.at[s, 'start']
-        stay_end = stays.at[s, 'end']
-        a = __lookup_census_index(census['Timestamp'], stay_start)
-        b = __lookup_census_index(census['Timestamp'], stay_end) + 1
-        for c in census.index[a:b]:
-            census_start = census.at[c, 'Timestamp']
-            y = max(census_start, stay_start)
-            z = min(census_start + one_hour, stay_end)
-            hours = 0.0 if y > z else ((z - y) / one_hour)
-            if hours != 0.0:
-                census.at[c, stays.at[s, column]] += hours
-                census.at[c, 'Total Census'] += hours
-            for model in models:
-                model.addVariableStaff(hours, census, c, stays, s)
+
+    # calculate the variable staffing
+    if len(models) > 0:
+        callbacks = [model for model in models if not isinstance(model, BatchStaffingModel)]
+        for model in models:
+            if isinstance(model, BatchStaffingModel):
+                model.addVariableStaff(overlaps, census, stays)
+        if len(callbacks) > 0:
+            for c, s, h in zip(overlaps['census'].tolist(), overlaps['stay'].tolist(), overlaps['hours'].tolist()):
+                for model in callbacks:
+                    model.addVariableStaff(h, census, c, stays, s)
 
     # calculate the fixed staffing levels and finalize the staffing
     for model in models:
-        for c in census.index:
-            model.addFixedStaff(census, c)
+        if isinstance(model, BatchStaffingModel):
+            model.addFixedStaff(census)
+        else:
+            for c in census.index:
+                model.addFixedStaff(census, c)
         model.finalize(census)
 
+
+def build_DataFrame(start_date: pd.Timestamp, end_date: pd.Timestamp, stays: pd.DataFrame, models: list = [], column: str = 'unit', freq: str = 'h') -> pd.DataFrame:
+    '''
+    Builds the census table with one row per freq (hourly by default) between start_date and end_date.
+    Each unit column holds the average number of patients during that row, which for hourly rows is
+    the same as the patient hours. Staffing models always receive patient hours.
+    '''
+
+    # create and initialize the census table
+    census = _timestamp_columns(pd.date_range(start=start_date, end=end_date, freq=freq, inclusive='left'))
+    units, groups = _column_codes(stays[column])
+
+    # calculate the census for every unit in one pass over the stays
+    bin_width = bin_width_of(freq)
+    bin_starts = census['Timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    stay_starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    stay_ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    hours = patient_hours(bin_starts, bin_width, stay_starts, stay_ends, groups, len(units))
+    census = _add_census_columns(census, hours, units, bin_width)
+    if len(models) > 0:
+        _apply_staffing_models(census, stays, models, _overlaps_table(census, stays, bin_starts, bin_width, stay_starts, stay_ends))
+
     # return the census to the caller
     return census
 
 
+def build_census_cube(start_date: pd.Timestamp, end_date: pd.Timestamp, stays: pd.DataFrame, dimensions: list = ['unit', 'disch_class', 'arrived_as'], freq: str = 'h') -> pd.DataFrame:
+    '''
+    Computes the census for every combination of the values in dimensions in a single pass over the stays
+    and returns it as a long-form table with one row per bin and combination that had any patients. Its
+    columns are 'Id' (the row of the matching build_DataFrame() table), 'Timestamp', one column per
+    dimension, and 'Census'. Any dimension or combination of dimensions can then be pivoted from the cube
+    with pivot_census_cube() without going back to the stays.
+    '''
+    timestamps = pd.date_range(start=start_date, end=end_date, freq=freq, inclusive='left')
+    bin_width = bin_width_of(freq)
+    codes, combinations = pd.factorize(pd.MultiIndex.from_frame(stays[dimensions]))
+    bin_starts = timestamps.as_unit('ns').asi8
+    stay_starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    stay_ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    hours = patient_hours(bin_starts, bin_width, stay_starts, stay_ends, codes.astype(np.int64), len(combinations))
+    if bin_width != 3600 * 10**9:
+        hours /= bin_width / np.float64(3600 * 10**9)
+    rows, cols = np.nonzero(hours)
+    cube = pd.DataFrame({'Id': rows, 'Timestamp': timestamps[rows]})
+    for n, name in enumerate(dimensions):
+        cube[name] = combinations.get_level_values(n)[cols]
+    cube['Census'] = hours[rows, cols]
+    cube.attrs = {'start_date': pd.Timestamp(start_date), 'end_date': pd.Timestamp(end_date), 'freq': freq}
+    return cube
+
+
+def pivot_census_cube(cube: pd.DataFrame, dimensions: list) -> pd.DataFrame:
+    '''
+    Sums a census cube from build_census_cube() over every dimension not in dimensions and returns it in the
+    layout of build_DataFrame(), with one column per value of the remaining dimension, or per tuple of values
+    when more than one dimension is kept. pivot_census_cube(cube, ['unit']) matches build_DataFrame().
+    '''
+    census = _timestamp_columns(pd.date_range(start=cube.attrs['start_date'], end=cube.attrs['end_date'], freq=cube.attrs['freq'], inclusive='left'))
+    table = cube.groupby(['Id'] + list(dimensions))['Census'].sum().unstack(list(dimensions), fill_value=0.0)
+    table = table.reindex(census.index, fill_value=0.0)
+    if len(dimensions) > 1:
+        table.columns = table.columns.to_flat_index()
+    table.columns.name = None
+    census['Total Census'] = table.sum(axis=1)
+    return pd.concat([census, table], axis=1)
+
+
+class SparseCensus:
+    '''
+    A census at any fixed bin width that is stored without a dense (bins x units) table.
+
+    For each unit, the whole bins covered by its stays form a step function that only changes where
+    a stay starts or ends, so only those breakpoints are kept. The partial first and last bins of
+    each stay are kept as a list of (bin, patient time) entries. Memory is proportional to the number
+    of stays rather than the number of bins, and columns or date ranges are expanded to the dense
+    layout of build_DataFrame() only when they are asked for.
+    '''
+
+    def __init__(self, start_date: pd.Timestamp, end_date: pd.Timestamp, stays: pd.DataFrame, column: str = 'unit', freq: str = 'h'):
+        self.timestamps = pd.date_range(start=start_date, end=end_date, freq=freq, inclusive='left')
+        self.bin_width = bin_width_of(freq)
+        self.units, groups = _column_codes(stays[column])
+        bin_count = len(self.timestamps)
+        stay_starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        stay_ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        t0 = self.timestamps[0].as_unit('ns').value if bin_count > 0 else 0
+        w = self.bin_width
+        s = np.clip(stay_starts - t0, 0, bin_count * w)
+        e = np.clip(stay_ends - t0, 0, bin_count * w)
+        keep = (e > s) & (groups >= 0)
+        s, e, g = s[keep], e[keep], groups[keep]
+        i = s // w
+        j = e // w
+        same = i == j
+
+        # partial bins, in nanoseconds of patient time
+        pos = np.concatenate([i[same], i[~same], j[~same]])
+        grp = np.concatenate([g[same], g[~same], g[~same]])
+        val = np.concatenate([e[same] - s[same], (i[~same] + 1) * w - s[~same], e[~same] - j[~same] * w])
+        self.__partials = self.__compress(grp, pos, val, bin_count, False)
+
+        # whole bins, as the running sum of a difference array
+        pos = np.concatenate([i[~same] + 1, j[~same]])
+        grp = np.concatenate([g[~same], g[~same]])
+        val = np.concatenate([np.full(len(j) - same.sum(), w), np.full(len(j) - same.sum(), -w)])
+        self.__steps = self.__compress(grp, pos, val, bin_count, True)
+
+    def __compress(self, groups: np.ndarray, positions: np.ndarray, values: np.ndarray, bin_count: int, cumulative: bool) -> list:
+        # Sums the values at each (group, position) and splits them into one (positions, values) pair per group.
+        # When cumulative is True, each value is replaced by the running total of its group.
+        keep = (positions < bin_count) & (values != 0)
+        groups, positions, values = groups[keep], positions[keep], values[keep]
+        order = np.lexsort((positions, groups))
+        groups, positions, values = groups[order], positions[order], values[order]
+        first = np.ones(len(groups), dtype=bool)
+        first[1:] = (groups[1:] != groups[:-1]) | (positions[1:] != positions[:-1])
+        starts = np.flatnonzero(first)
+        groups, positions = groups[starts], positions[starts]
+        values = np.add.reduceat(values, starts) if len(values) > 0 else values
+        bounds = np.searchsorted(groups, np.arange(len(self.units) + 1))
+        result = []
+        for n in range(len(self.units)):
+            v = values[bounds[n]:bounds[n + 1]]
+            result.append((positions[bounds[n]:bounds[n + 1]], np.cumsum(v) if cumulative else v))
+        return result
+
+    @property
+    def nbytes(self) -> int:
+        return sum(p.nbytes + v.nbytes for p, v in self.__partials + self.__steps)
+
+    def column(self, unit, start: int = 0, stop: int = None) -> np.ndarray:
+        '''The average number of patients on unit in each bin from position start up to stop.'''
+        stop = len(self.timestamps) if stop is None else stop
+        n = self.units.index(unit)
+        positions, values = self.__steps[n]
+        k = np.searchsorted(positions, np.arange(start, stop), side='right') - 1
+        result = np.where(k >= 0, values[np.maximum(k, 0)] if len(values) > 0 else 0, 0).astype(np.float64)
+        positions, values = self.__partials[n]
+        a, b = np.searchsorted(positions, [start, stop])
+        result[positions[a:b] - start] += values[a:b]
+        return result / np.float64(self.bin_width)
+
+    def to_DataFrame(self, start_date: pd.Timestamp = None, end_date: pd.Timestamp = None, units: list = None) -> pd.DataFrame:
+        '''Expands the bins between start_date and end_date to the layout of build_DataFrame().'''
+        start = 0 if start_date is None else self.timestamps.searchsorted(pd.Timestamp(start_date))
+        stop = len(self.timestamps) if end_date is None else self.timestamps.searchsorted(pd.Timestamp(end_date))
+        units = self.units if units is None else units
+        census = _timestamp_columns(self.timestamps[start:stop])
+        census.index = pd.RangeIndex(start, stop, name='Id')
+        values = {unit: self.column(unit, start, stop) for unit in self.units}
+        census['Total Census'] = np.sum([values[unit] for unit in self.units], axis=0) if self.units else 0.0
+        return pd.concat([census, pd.DataFrame({unit: values[unit] for unit in units}, index=census.index)], axis=1)
+
+
 # for testing
 if __name__ == '__main__':
+    from Instrumentation import Instrumentation
+    import AdtEvents as adt
+    import PatientStays as ps
+    import sys
 
-    print('Building file list...')
-    import os
-    data_dir = os.path.abspath('..\\..\\data\\2021\\IAH\\Q2')
-    adt_file_list = [os.path.join(data_dir, file) for file in os.listdir(data_dir) if file.endswith('.csv')]
+    # the whole pipeline from the ADT files to the census workbook, one json line per step
+    instrumentation = Instrumentation(sys.stdout)
 
-    print('Parsing ADT event files and building the ADT EventDataset...')
-    events = adt.read_from_csv(adt_file_list)
+    with instrumentation.stage('list_files'):
+        data_dir = os.path.abspath('..\\..\\data\\2021\\IAH\\Q2')
+        adt_file_list = [os.path.join(data_dir, file) for file in os.listdir(data_dir) if file.endswith('.csv')]
 
-    print('Building the StayDataset...')
-    import PatientStays as ps
-    stays = ps.build_dataset(events)
+    with instrumentation.stage('read_from_csv', files=len(adt_file_list)) as record:
+        events = adt.read_from_csv(adt_file_list, stats=record)
 
-    print('Calculating the census...')
-    census = build_DataFrame(pd.Timestamp(events.start_date), pd.Timestamp(events.end_date), stays)
+    with instrumentation.stage('build_dataset') as record:
+        stays = ps.build_dataset(events, stats=record)
 
-    print('Writing the StayDataset to "./output files/patient_census_test.xlsx"...')
-    with pd.ExcelWriter('../output files/patient_census_test.xlsx') as writer:
-        census.to_excel(writer, sheet_name='MyFirstSheet')
+    with instrumentation.stage('build_DataFrame') as record:
+        census = build_DataFrame(pd.Timestamp(events.start_date), pd.Timestamp(events.end_date), stays)
+        record['rows'] = len(census)
 
-    print('Done!')
+    with instrumentation.stage('write_xlsx', rows=len(census)):
+        with pd.ExcelWriter('../output files/patient_census_test.xlsx') as writer:
+            census.to_excel(writer, sheet_name='MyFirstSheet')
@@ -1,178 +1,394 @@
 
-from pandas import DataFrame, ExcelWriter
+from __future__ import annotations
 from datetime import datetime
-from collections import namedtuple
+from collections import namedtuple, deque
+from itertools import repeat
 import AdtEvents as adt
 from xlsxutil import one_hour, list_csv_files_in
 from Encounter import Encounter
 from Event import Event
+from lazyutil import LazyModule
 
+# pandas is only imported when a DataFrame is first built
+pd = LazyModule('pandas')
 
-def build_dataset(dataset: adt.EventDataset) -> DataFrame:
-
-    Stay = namedtuple('Stay', ['HAR', 'disch_class', 'unit', 'start', 'end', 'hours', 'status', 'came_from', 'went_to', 'arrived_as', 'left_as'])
-
-    # helper function used exclusively here
-    # Iterates over a list of events and raises a ValueError if the list is invalid.
-    # A list of events is considered invalid if any of any of the following are true:
-    #    1.) event.evt_type == 'Update' for any event in the list
-    #    2.) event.from_unit == event.to_unit for any event in the list
-    #    3.) any event in the list is type 'Admission' and that event is not the first event in the list
-    #    4.) any event in the list is type 'Discharge' and that event is not the last event in the list
-    #    5.) the list is not in chronological order by effective date
-    #    6.) if the 'to_unit' for any event is not equal to the 'from_unit' for the next event in the list
-    def __validate_events(encounter: Encounter, events: list) -> None:
-        i = 0
-        while i < len(events):
-            if events[i].evt_type == 'Update':
-                raise ValueError('Event type cannot be "Update"\n' + Event.build_event_table_str(events, encounter))
-            if events[i].from_unit == events[i].to_unit and events[i].from_class == events[i].to_class:
-                raise ValueError('"From Unit" == "To Unit" and "From Class" == "To Class"\n' + Event.build_event_table_str(events, encounter))
-            if events[i].evt_type == 'Admission' and i != 0:
-                raise ValueError('Admission is not the first event.\n' + Event.build_event_table_str(events, encounter))
-            if events[i].evt_type == 'Discharge' and i != len(events) - 1:
-                raise ValueError('Discharge is not the last event.\n' + Event.build_event_table_str(events, encounter))
-            if i + 1 < len(events):
-                if events[i].eff_date > events[i + 1].eff_date:
-                    raise ValueError('Effective dates are not in chronological order\n' + Event.build_event_table_str(events, encounter))
-                if events[i].to_unit != events[i + 1].from_unit:
-                    raise ValueError('There appears to be a missing event\n' + Event.build_event_table_str(events, encounter))
-            i += 1
-
-    # nested helper function
-    def __latest_existing_date(a: datetime, b: datetime) -> datetime:
-        x = isinstance(a, datetime)
-        y = isinstance(b, datetime)
-        if x and not y:
-            return a
-        if y and not x:
-            return b
-        if not x and not y:
-            raise ValueError('__latest_existing_date() requires at least one valid datetime object')
-        return max(a, b)
-
-    # nested helper function
-    def __get_eff_date(encounter: Encounter, event: Event) -> datetime:
-        return min(encounter.arrival_datetime, event.eff_date) if event.evt_type == 'Admission' and encounter.arrival_datetime is not None else event.eff_date
-
-    # nested helper function
-    def __delete_duplicates(events: list) -> None:
-        def duplicates(a: Event, b: Event) -> bool:
-            return (a.eff_date == b.eff_date and
-                    a.evt_type == b.evt_type and
-                    a.from_unit == b.from_unit and
-                    a.to_unit == b.to_unit)
-        i = 0
-        while i < len(events):
-            j = i + 1
-            while j < len(events):
-                if duplicates(events[i], events[j]):
-                    del events[j]
-                    continue
-                j += 1
-            i += 1
-
-    # nested helper function
-    def __sort_out_of_order(events: list) -> None:
-        def out_of_order(a: Event, b: Event) -> bool:
-            return (a.eff_date == b.eff_date and
-                    a.from_unit == b.to_unit and
-                    a.to_unit != b.from_unit)
-        i = 0
-        while i < len(events):
-            j = i + 1
-            while j < len(events):
-                if out_of_order(events[i], events[j]):
-                    temp = events.pop(j)
-                    events.insert(i, temp)
-                    j = i
-                j += 1
-            i += 1
-
-    # nested helper function
-    def __delete_cancellations(events: list) -> None:
-        def cancels(a: Event, b: Event) -> bool:
-            return (a.eff_date == b.eff_date and
-                    a.evt_type == b.evt_type and
-                    a.from_unit == b.to_unit and
-                    a.to_unit == b.from_unit)
-        i = 0
-        while i < len(events):
-            j = i + 1
-            while j < len(events):
-                if cancels(events[i], events[j]):
-                    del events[j]
-                    del events[i]
-                    j = i
-                j += 1
-            i += 1
-
-    # The real work begins here...
-    data = []
+
+Stay = namedtuple('Stay', ['HAR', 'disch_class', 'unit', 'start', 'end', 'hours', 'status', 'came_from', 'went_to', 'arrived_as', 'left_as'])
+
+
+# The unit and patient class names that the fields of a stay can hold, with department synonyms already
+# resolved. build_dataset() stores those fields as categoricals over these shared, sorted lists, so the
+# stays hold small integer codes instead of strings, and every stays DataFrame built from the same
+# dictionary has the same categories, which keeps their codes comparable when they are grouped or concatenated.
+StayDictionary = namedtuple('StayDictionary', ['units', 'classes'])
+
+# the Stay fields stored as categoricals, by the list of StayDictionary they use
+unit_fields = ['unit', 'came_from', 'went_to']
+class_fields = ['disch_class', 'arrived_as', 'left_as']
+stay_statuses = ['In-house as of start date', 'Patient stay is complete', 'In-house as of end date']
+
+
+def build_dictionary(dataset: adt.EventDataset) -> StayDictionary:
+    '''Collects every unit, discharge disposition and patient class name in a dataset into a StayDictionary.'''
+    units = {'Home or Self Care', 'Unknown'}
+    classes = {'Unknown'}
     for encounter, event_set in dataset.data.items():
-        events = [e for e in sorted(event_set, key=lambda x: x.eff_date) if e.evt_type != 'Update' and e.from_unit != e.to_unit]
-        if len(events) == 0:
+        units.add(encounter.disch_disp)
+        classes.add(encounter.disch_class)
+        for event in event_set:
+            units.add(event.from_unit)
+            units.add(event.to_unit)
+            classes.add(event.from_class)
+            classes.add(event.to_class)
+    units.discard(None)
+    classes.discard(None)
+    return StayDictionary(sorted(units), sorted(classes))
+
+
+def stays_frame(data: list, dictionary: StayDictionary = None) -> pd.DataFrame:
+    '''
+    Builds a stays DataFrame from a list of Stay tuples. When a dictionary is given, the unit, class and
+    status fields are categoricals, which export to csv and Excel as their names. A ValueError naming them
+    is raised if the stays hold any unit or class name that is not in the dictionary.
+    '''
+    stays = pd.DataFrame(data, columns=Stay._fields)
+    if dictionary is not None:
+        for field in unit_fields:
+            stays[field] = _categorical(stays[field], dictionary.units, field)
+        for field in class_fields:
+            stays[field] = _categorical(stays[field], dictionary.classes, field)
+        stays['status'] = _categorical(stays['status'], stay_statuses, 'status')
+    return stays
+
+
+# helper function used by stays_frame()
+# Converts a column to a categorical, raising a ValueError instead of silently turning values
+# that are not in categories into NaN.
+def _categorical(values: pd.Series, categories: list, field: str) -> pd.Categorical:
+    result = pd.Categorical(values)
+    unknown = result.categories.difference(categories)
+    if len(unknown) > 0:
+        names = sorted(unknown)
+        raise ValueError(f'The "{field}" column has values that are not in the StayDictionary: {names}. '
+                         'Add them to the dictionary, or build a new one with build_dictionary().')
+    return result.set_categories(categories)
+
+
+# An encounter whose events failed validation. reason is one of the codes returned by
+# _find_invalid_event() and event_index is the position of the offending event in events.
+InvalidEncounter = namedtuple('InvalidEncounter', ['HAR', 'admit_datetime', 'reason', 'message', 'event_index', 'encounter', 'events'])
+
+
+class InvalidEncounterError(ValueError):
+    '''
+    Raised by build_dataset() for an encounter whose events are invalid. The table of events shown
+    in the message is only rendered when the exception is converted to a string.
+    '''
+
+    def __init__(self, invalid: InvalidEncounter):
+        super().__init__(invalid)
+        self.invalid = invalid
+
+    def __str__(self):
+        return describe_invalid_encounter(self.invalid)
+
+
+def describe_invalid_encounter(invalid: InvalidEncounter) -> str:
+    '''Renders the reason an encounter is invalid along with a table of its events.'''
+    return invalid.message + '\n' + Event.build_event_table_str(invalid.events, invalid.encounter)
+
+
+def quarantine_table(quarantine: list) -> pd.DataFrame:
+    '''Summarizes a list of InvalidEncounter records from build_dataset(quarantine=...) with one row per encounter.'''
+    return pd.DataFrame([(q.HAR, q.admit_datetime, q.reason, q.message, q.event_index, len(q.events)) for q in quarantine],
+                     columns=['HAR', 'admit_datetime', 'reason', 'message', 'event_index', 'event_count'])
+
+
+# helper function used by build_dataset()
+# Iterates over a list of events and returns an InvalidEncounter if the list is invalid, or None if it is valid.
+# A list of events is considered invalid if any of any of the following are true:
+#    1.) event.evt_type == 'Update' for any event in the list                                           ('update_event')
+#    2.) event.from_unit == event.to_unit for any event in the list                                      ('no_change')
+#    3.) any event in the list is type 'Admission' and that event is not the first event in the list     ('admission_not_first')
+#    4.) any event in the list is type 'Discharge' and that event is not the last event in the list      ('discharge_not_last')
+#    5.) the list is not in chronological order by effective date                                         ('out_of_order')
+#    6.) if the 'to_unit' for any event is not equal to the 'from_unit' for the next event in the list   ('missing_event')
+def _find_invalid_event(encounter: Encounter, events: list) -> InvalidEncounter:
+    def invalid(reason: str, message: str, i: int) -> InvalidEncounter:
+        return InvalidEncounter(encounter.har, encounter.admit_datetime, reason, message, i, encounter, events)
+    i = 0
+    while i < len(events):
+        if events[i].evt_type == 'Update':
+            return invalid('update_event', 'Event type cannot be "Update"', i)
+        if events[i].from_unit == events[i].to_unit and events[i].from_class == events[i].to_class:
+            return invalid('no_change', '"From Unit" == "To Unit" and "From Class" == "To Class"', i)
+        if events[i].evt_type == 'Admission' and i != 0:
+            return invalid('admission_not_first', 'Admission is not the first event.', i)
+        if events[i].evt_type == 'Discharge' and i != len(events) - 1:
+            return invalid('discharge_not_last', 'Discharge is not the last event.', i)
+        if i + 1 < len(events):
+            if events[i].eff_date > events[i + 1].eff_date:
+                return invalid('out_of_order', 'Effective dates are not in chronological order', i)
+            if events[i].to_unit != events[i + 1].from_unit:
+                return invalid('missing_event', 'There appears to be a missing event', i)
+        i += 1
+    return None
+
+
+# helper function used by build_dataset()
+# Raises an InvalidEncounterError if the list of events is invalid.
+def _validate_events(encounter: Encounter, events: list) -> None:
+    invalid = _find_invalid_event(encounter, events)
+    if invalid is not None:
+        raise InvalidEncounterError(invalid)
+
+
+# helper function used by build_dataset()
+def _get_eff_date(encounter: Encounter, event: Event) -> datetime:
+    return min(encounter.arrival_datetime, event.eff_date) if event.evt_type == 'Admission' and encounter.arrival_datetime is not None else event.eff_date
+
+
+# helper function used by build_dataset()
+# Keeps the first of each group of events that share the same effective date, type, and units.
+def _delete_duplicates(events: list) -> None:
+    seen = set()
+    unique = []
+    for event in events:
+        key = (event.eff_date, event.evt_type, event.from_unit, event.to_unit)
+        if key not in seen:
+            seen.add(key)
+            unique.append(event)
+    events[:] = unique
+
+
+# helper function used by build_dataset()
+# Moves events that share an effective date so that an event leading into a unit comes before
+# the event leading out of it. Only events with the same effective date are ever reordered, so
+# each run of equal dates is sorted separately, and runs of a single event are skipped.
+def _sort_out_of_order(events: list) -> None:
+    def out_of_order(a: Event, b: Event) -> bool:
+        return (a.from_unit == b.to_unit and
+                a.to_unit != b.from_unit)
+    start = 0
+    while start < len(events):
+        end = start + 1
+        while end < len(events) and events[end].eff_date == events[start].eff_date:
+            end += 1
+        if end - start > 1:
+            group = events[start:end]
+            i = 0
+            while i < len(group):
+                j = i + 1
+                while j < len(group):
+                    if out_of_order(group[i], group[j]):
+                        temp = group.pop(j)
+                        group.insert(i, temp)
+                        j = i
+                    j += 1
+                i += 1
+            events[start:end] = group
+        start = end
+
+
+# helper function used by build_dataset()
+# Removes pairs of events where the later one reverses the earlier one at the same effective date.
+# Each event is paired with the first remaining event after it that cancels it, which is found by
+# looking up the reversed key in a queue of event positions instead of rescanning the list.
+def _delete_cancellations(events: list) -> None:
+    positions = {}
+    for i, event in enumerate(events):
+        key = (event.eff_date, event.evt_type, event.from_unit, event.to_unit)
+        queue = positions.get(key, None)
+        if queue:
+            queue.append(i)
+        else:
+            positions[key] = deque([i])
+    deleted = [False] * len(events)
+    for i, event in enumerate(events):
+        if deleted[i]:
             continue
-        __delete_duplicates(events)
-        __delete_cancellations(events)
-        __sort_out_of_order(events)
-        __validate_events(encounter, events)
-        first_event = events[0]
-        effective_date = __get_eff_date(encounter, first_event)
-        if first_event.evt_type != 'Admission' and dataset.start_date < effective_date:
-            unit = first_event.from_unit
-            arrival = dataset.start_date
-            departure = effective_date
-            hours = (departure - arrival) / one_hour
-            status = 'In-house as of start date'
-            came_from = 'Unknown'
-            went_to = encounter.disch_disp if first_event.evt_type == 'Discharge' else first_event.to_unit
-            arrived_as = 'Unknown'
-            left_as = first_event.from_class
-            data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
-        for i in range(len(events) - 1):
-            curr_event = events[i]
-            next_event = events[i + 1]
-            unit = curr_event.to_unit
-            arrival = max(__get_eff_date(encounter, curr_event), dataset.start_date)
-            departure = next_event.eff_date
-            hours = (departure - arrival) / one_hour
-            status = 'Patient stay is complete'
-            came_from = 'Home or Self Care' if curr_event.evt_type == 'Admission' else curr_event.from_unit
-            went_to = encounter.disch_disp if next_event.evt_type == 'Discharge' else next_event.to_unit
-            arrived_as = curr_event.to_class
-            left_as = next_event.from_class
-            data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
-        last_event = events[-1]
-        effective_date = __get_eff_date(encounter, last_event)
-        if last_event.evt_type != 'Discharge' and effective_date < dataset.end_date:
-            unit = last_event.to_unit
-            arrival = effective_date
-            departure = dataset.end_date
-            hours = (departure - arrival) / one_hour
-            status = 'In-house as of end date'
-            came_from = 'Home or Self Care' if curr_event.evt_type == 'Admission' else last_event.from_unit
-            went_to = 'Unknown'
-            arrived_as = last_event.to_class
-            left_as = 'Unknown'
-            data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
-    return DataFrame(data)
+        queue = positions.get((event.eff_date, event.evt_type, event.to_unit, event.from_unit), None)
+        while queue and (queue[0] <= i or deleted[queue[0]]):
+            queue.popleft()
+        if queue:
+            deleted[queue.popleft()] = True
+            deleted[i] = True
+    events[:] = [event for i, event in enumerate(events) if not deleted[i]]
+
+
+def _add_stats(stats: dict, counts: dict) -> None:
+    for key, value in counts.items():
+        stats[key] = stats.get(key, 0) + value
+
+
+def _encounter_stays(encounter: Encounter, event_set: set, start_date: datetime, end_date: datetime, stats: dict = None, quarantine: list = None) -> list:
+    # Cleans up the events of a single encounter and returns the list of its stays.
+    # When stats is given, the number of events dropped by each cleanup pass are added to it.
+    # When quarantine is given, an invalid encounter is appended to it instead of raising an error.
+    data = []
+    events = [e for e in sorted(event_set, key=lambda x: x.eff_date) if e.evt_type != 'Update' and e.from_unit != e.to_unit]
+    if stats is not None:
+        updates = sum(1 for e in event_set if e.evt_type == 'Update')
+        _add_stats(stats, {'encounters': 1, 'events': len(event_set), 'updates_dropped': updates,
+                           'no_unit_change_dropped': len(event_set) - len(events) - updates})
+    if len(events) == 0:
+        return data
+    count = len(events)
+    _delete_duplicates(events)
+    if stats is not None:
+        _add_stats(stats, {'duplicates_dropped': count - len(events)})
+        count = len(events)
+    _delete_cancellations(events)
+    if stats is not None:
+        _add_stats(stats, {'cancellations_dropped': count - len(events)})
+    _sort_out_of_order(events)
+    if quarantine is None:
+        _validate_events(encounter, events)
+    else:
+        invalid = _find_invalid_event(encounter, events)
+        if invalid is not None:
+            quarantine.append(invalid)
+            if stats is not None:
+                _add_stats(stats, {'quarantined': 1})
+            return data
+    first_event = events[0]
+    effective_date = _get_eff_date(encounter, first_event)
+    if first_event.evt_type != 'Admission' and start_date < effective_date:
+        unit = first_event.from_unit
+        arrival = start_date
+        departure = effective_date
+        hours = (departure - arrival) / one_hour
+        status = 'In-house as of start date'
+        came_from = 'Unknown'
+        went_to = encounter.disch_disp if first_event.evt_type == 'Discharge' else first_event.to_unit
+        arrived_as = 'Unknown'
+        left_as = first_event.from_class
+        data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
+    for i in range(len(events) - 1):
+        curr_event = events[i]
+        next_event = events[i + 1]
+        unit = curr_event.to_unit
+        arrival = max(_get_eff_date(encounter, curr_event), start_date)
+        departure = next_event.eff_date
+        hours = (departure - arrival) / one_hour
+        status = 'Patient stay is complete'
+        came_from = 'Home or Self Care' if curr_event.evt_type == 'Admission' else curr_event.from_unit
+        went_to = encounter.disch_disp if next_event.evt_type == 'Discharge' else next_event.to_unit
+        arrived_as = curr_event.to_class
+        left_as = next_event.from_class
+        data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
+    last_event = events[-1]
+    effective_date = _get_eff_date(encounter, last_event)
+    if last_event.evt_type != 'Discharge' and effective_date < end_date:
+        unit = last_event.to_unit
+        arrival = effective_date
+        departure = end_date
+        hours = (departure - arrival) / one_hour
+        status = 'In-house as of end date'
+        came_from = 'Home or Self Care' if last_event.evt_type == 'Admission' else last_event.from_unit
+        went_to = 'Unknown'
+        arrived_as = last_event.to_class
+        left_as = 'Unknown'
+        data.append(Stay(encounter.har, encounter.disch_class, unit, arrival, departure, hours, status, came_from, went_to, arrived_as, left_as))
+    return data
+
+
+def _chunk_stays(items: list, start_date: datetime, end_date: datetime, quarantine: bool) -> tuple:
+    # Builds the stays for a list of (encounter, event_set) items inside a worker process.
+    data = []
+    stats = {}
+    invalid = [] if quarantine else None
+    for encounter, event_set in items:
+        data.extend(_encounter_stays(encounter, event_set, start_date, end_date, stats, invalid))
+    return data, stats, invalid
+
+
+def build_dataset(dataset: adt.EventDataset, workers: int = 1, chunk_size: int = 1000, stats: dict = None, quarantine: list = None,
+                  dictionary: StayDictionary = None, categorical: bool = True) -> pd.DataFrame:
+    '''
+    Builds a DataFrame with one row per patient stay on a unit from an EventDataset.
+
+    Each encounter is independent, so when workers is greater than 1 the encounters are split
+    into chunks of chunk_size and processed in a pool of that many processes. The stays are
+    returned in the same order either way. Pass workers=None to use one process per CPU.
+
+    When a stats dict is given, the counts of encounters, events, stays and events dropped by
+    each cleanup pass are added to it.
+
+    An invalid encounter raises an InvalidEncounterError. When a quarantine list is given instead,
+    each invalid encounter is appended to it as an InvalidEncounter, its stays are left out, and the
+    rest of the dataset is processed. See quarantine_table() and describe_invalid_encounter().
+
+    The unit, class and status columns are categoricals over a StayDictionary, which is built from the
+    dataset unless one is given. A dictionary that is reused across extracts must hold every unit and
+    class name in the dataset, or a ValueError naming the missing ones is raised. Categoricals compare
+    equal to their names, but code that checks for object dtypes or uses the .str accessor on these
+    columns should pass categorical=False to get plain string columns instead.
+    '''
+    if categorical and dictionary is None:
+        dictionary = build_dictionary(dataset)
+    elif not categorical:
+        dictionary = None
+    if workers == 1:
+        data = []
+        for encounter, event_set in dataset.data.items():
+            data.extend(_encounter_stays(encounter, event_set, dataset.start_date, dataset.end_date, stats, quarantine))
+        if stats is not None:
+            _add_stats(stats, {'stays': len(data)})
+        return stays_frame(data, dictionary)
+    items = list(dataset.data.items())
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    data = []
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for stays, chunk_stats, invalid in executor.map(_chunk_stays, chunks, repeat(dataset.start_date), repeat(dataset.end_date), repeat(quarantine is not None)):
+            data.extend(stays)
+            if stats is not None:
+                _add_stats(stats, chunk_stats)
+            if quarantine is not None:
+                quarantine.extend(invalid)
+    if stats is not None:
+        _add_stats(stats, {'stays': len(data)})
+    return stays_frame(data, dictionary)
+
+
+def iter_stays(encounters, start_date: datetime, end_date: datetime, chunk_size: int = 100000, quarantine: list = None,
+               dictionary: StayDictionary = None):
+    '''
+    Streaming version of build_dataset(). Consumes (encounter, event set) pairs one at a time, for
+    example from AdtEvents.iter_encounters(), and yields DataFrames of at most chunk_size stays.
+    start_date and end_date bound the 'In-house as of start/end date' stays and can be found up front
+    with AdtEvents.scan_date_range(). Concatenating the chunks gives the same rows as build_dataset().
+    quarantine works the same way as in build_dataset(). The encounters are not known up front, so the
+    columns are only categoricals when a StayDictionary is given, and then every chunk shares its categories.
+    '''
+    data = []
+    for encounter, event_set in encounters:
+        data.extend(_encounter_stays(encounter, event_set, start_date, end_date, None, quarantine))
+        if len(data) >= chunk_size:
+            yield stays_frame(data[:chunk_size], dictionary)
+            data = data[chunk_size:]
+    if len(data) > 0:
+        yield stays_frame(data, dictionary)
 
 
 # for testing
 if __name__ == '__main__':
+    from Instrumentation import Instrumentation
+    import sys
 
-    print('Building file list...')
-    adt_file_list = list_csv_files_in('..\\data\\2021\\IAH\\Q2')
+    # the build_dataset() record holds the number of events dropped by each cleanup pass
+    instrumentation = Instrumentation(sys.stdout)
 
-    print('Parsing ADT event files and building the ADT EventDataset...')
-    events = adt.read_from_csv(adt_file_list)
+    with instrumentation.stage('list_files'):
+        adt_file_list = list_csv_files_in('..\\data\\2021\\IAH\\Q2')
 
-    print('Building the StayDataset...')
-    stays = build_dataset(events)
+    with instrumentation.stage('read_from_csv', files=len(adt_file_list)) as record:
+        events = adt.read_from_csv(adt_file_list, stats=record)
 
-    print('Writing the StayDataset to "./output files/patient_stays_test.xlsx"...')
-    with ExcelWriter('./output files/patient_stays_test.xlsx') as writer:
-        stays.to_excel(writer, sheet_name='MyFirstSheet')
+    with instrumentation.stage('build_dataset') as record:
+        stays = build_dataset(events, stats=record)
 
-    print('Done!')
+    with instrumentation.stage('write_xlsx', rows=len(stays)):
+        with pd.ExcelWriter('./output files/patient_stays_test.xlsx') as writer:
+            stays.to_excel(writer, sheet_name='MyFirstSheet')
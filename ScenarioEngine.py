@@ -0,0 +1,78 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+import PatientCensus as pc
+import Checkpoint
+import pandas as pd
+import numpy as np
+import tempfile
+import os
+
+# Compares many staffing model scenarios against the same stays. The census, the stays and the table
+# of (census row, stay, hours) overlaps that the models receive are computed once and saved as a
+# Checkpoint on a shared memory file system when one is available (/dev/shm). Each worker process
+# memory-maps them read-only, so the pool shares one copy of the data however many scenarios run.
+
+# models is a list of StaffingModel or BatchStaffingModel objects that are run together, and
+# hourly_rate is the cost of one staff hour, or None to leave the cost of the scenario blank.
+Scenario = namedtuple('Scenario', ['name', 'models', 'hourly_rate'], defaults=[None])
+
+# the census, stays and overlaps tables shared by every scenario in a worker process
+_shared = None
+
+
+def _load_shared(directory: str) -> None:
+    # initializer of the worker processes
+    global _shared
+    census = Checkpoint.load_frame(os.path.join(directory, 'census'))
+    stays = Checkpoint.load_frame(os.path.join(directory, 'stays'))
+    overlaps = Checkpoint.load_frame(os.path.join(directory, 'overlaps'))
+    _shared = (census, stays, overlaps, Checkpoint.load_attrs(os.path.join(directory, 'census'))['bin_hours'])
+
+
+def _evaluate(scenario: Scenario, census: pd.DataFrame, stays: pd.DataFrame, overlaps: pd.DataFrame, bin_hours: float) -> dict:
+    # Runs the models of a scenario on a shallow copy of the census and summarizes the columns they add
+    census = census.copy(deep=False)
+    before = set(census.columns)
+    pc._apply_staffing_models(census, stays, scenario.models, overlaps)
+    staff = census[[c for c in census.columns if c not in before]].sum(axis=1)
+    staff_hours = float(staff.sum() * bin_hours)
+    return {'scenario': scenario.name,
+            'staff_hours': staff_hours,
+            'peak_staff': float(staff.max()) if len(staff) > 0 else 0.0,
+            'mean_staff': float(staff.mean()) if len(staff) > 0 else 0.0,
+            'cost': np.nan if scenario.hourly_rate is None else staff_hours * scenario.hourly_rate
+            }
+
+
+def _run_scenario(scenario: Scenario) -> dict:
+    return _evaluate(scenario, *_shared)
+
+
+def run_scenarios(start_date: pd.Timestamp, end_date: pd.Timestamp, stays: pd.DataFrame, scenarios: list, column: str = 'unit',
+                  freq: str = 'h', workers: int = None, chunksize: int = 1) -> pd.DataFrame:
+    '''
+    Builds the census of the stays once and runs every Scenario against it in a pool of workers processes,
+    one per CPU by default, or in this process when workers is 1. The models must be picklable, so define
+    their classes at module level.
+
+    Returns a table with one row per scenario in the order given: the total staff hours, the peak and mean
+    number of staff in a census row, and the cost. The staff of a scenario are the columns its models add
+    to the census, which is the same census build_DataFrame() would return with those models.
+    '''
+    census = pc.build_DataFrame(start_date, end_date, stays, [], column, freq)
+    bin_width = pc.bin_width_of(freq)
+    bin_starts = census['Timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    stay_starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    stay_ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    overlaps = pc._overlaps_table(census, stays, bin_starts, bin_width, stay_starts, stay_ends)
+    bin_hours = bin_width / np.float64(3600 * 10**9)
+    if workers == 1:
+        results = [_evaluate(scenario, census, stays, overlaps, bin_hours) for scenario in scenarios]
+    else:
+        with tempfile.TemporaryDirectory(dir='/dev/shm' if os.path.isdir('/dev/shm') else None) as directory:
+            Checkpoint.save_frame(census, os.path.join(directory, 'census'), {'bin_hours': float(bin_hours)})
+            Checkpoint.save_frame(stays, os.path.join(directory, 'stays'))
+            Checkpoint.save_frame(overlaps, os.path.join(directory, 'overlaps'))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_load_shared, initargs=(directory,)) as executor:
+                results = list(executor.map(_run_scenario, scenarios, chunksize=chunksize))
+    return pd.DataFrame(results, columns=['scenario', 'staff_hours', 'peak_staff', 'mean_staff', 'cost'])
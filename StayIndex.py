@@ -0,0 +1,143 @@
+import pandas as pd
+import numpy as np
+
+
+def _to_ns(value) -> np.int64:
+    return np.int64(pd.Timestamp(value).as_unit('ns').value)
+
+
+class IntervalTree:
+    '''
+    A static centered interval tree over half-open [start, end) intervals of int64 values.
+    Each node keeps the intervals that contain its center sorted by start and by end, so a
+    point or range query visits O(log n) nodes, does a binary search in each, and returns
+    the positions of the k matching intervals in O(log² n + k) time.
+    '''
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, positions: np.ndarray = None):
+        if positions is None:
+            positions = np.arange(len(starts))
+        keep = ends > starts
+        self.nodes = []
+        self.root = self.__build(starts[keep], ends[keep], positions[keep])
+
+    def __build(self, starts: np.ndarray, ends: np.ndarray, positions: np.ndarray) -> int:
+        if len(starts) == 0:
+            return -1
+        center = np.sort(starts + (ends - starts) // 2)[len(starts) // 2]
+        left = ends <= center
+        right = starts > center
+        here = ~(left | right)
+        by_start = np.argsort(starts[here], kind='stable')
+        by_end = np.argsort(ends[here], kind='stable')
+        node = [center,
+                starts[here][by_start], positions[here][by_start],
+                ends[here][by_end], positions[here][by_end],
+                -1, -1]
+        index = len(self.nodes)
+        self.nodes.append(node)
+        node[5] = self.__build(starts[left], ends[left], positions[left])
+        node[6] = self.__build(starts[right], ends[right], positions[right])
+        return index
+
+    def overlapping(self, start: np.int64, end: np.int64) -> np.ndarray:
+        '''Returns the positions of the intervals that overlap [start, end), or contain start if start == end.'''
+        found = []
+        index = self.root
+        stack = [index] if index >= 0 else []
+        while stack:
+            center, s_starts, s_positions, e_ends, e_positions, left, right = self.nodes[stack.pop()]
+            if center < start:
+                # every interval here starts before start, so it only needs to end after it
+                found.append(e_positions[np.searchsorted(e_ends, start, side='right'):])
+            elif center >= end and end > start:
+                # every interval here ends after end, so it only needs to start before it
+                found.append(s_positions[:np.searchsorted(s_starts, end, side='left')])
+            elif center >= end:
+                found.append(s_positions[:np.searchsorted(s_starts, start, side='right')])
+            else:
+                found.append(s_positions)
+            if left >= 0 and start < center:
+                stack.append(left)
+            if right >= 0 and (end > center or start > center):
+                stack.append(right)
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+
+class StayIndex:
+    '''
+    An index over the stays DataFrame from PatientStays.build_dataset() that answers census
+    questions at arbitrary timestamps without building an hourly census table.
+
+    A patient is counted on a unit from the 'start' of a stay up to, but not including, its 'end'.
+    Headcounts use per-unit sorted start and end arrays and take O(log n). Patient lists and
+    range queries use an IntervalTree per unit and take O(log² n + k) for k matching stays.
+    '''
+
+    def __init__(self, stays: pd.DataFrame, column: str = 'unit'):
+        self.stays = stays
+        self.column = column
+        starts = stays['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        ends = stays['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        keep = ends > starts
+        groups = stays[column].to_numpy()
+        self.__sorted = {}
+        self.__trees = {}
+        for unit in pd.unique(groups):
+            mask = groups == unit
+            self.__sorted[unit] = (np.sort(starts[mask & keep]), np.sort(ends[mask & keep]))
+            self.__trees[unit] = IntervalTree(starts[mask], ends[mask], np.flatnonzero(mask))
+        self.__sorted[None] = (np.sort(starts[keep]), np.sort(ends[keep]))
+        self.__starts = starts
+        self.__ends = ends
+
+    @property
+    def units(self) -> list:
+        return list(self.__trees.keys())
+
+    def __units(self, units) -> list:
+        if units is None:
+            return self.units
+        if isinstance(units, str) or not hasattr(units, '__iter__'):
+            return [units]
+        return list(units)
+
+    def headcount(self, timestamp, units=None) -> int:
+        '''The number of patients on the given unit or list of units (default: all) at timestamp.'''
+        t = _to_ns(timestamp)
+        keys = [None] if units is None else self.__units(units)
+        count = 0
+        for unit in keys:
+            starts, ends = self.__sorted.get(unit, (np.zeros(0), np.zeros(0)))
+            count += np.searchsorted(starts, t, side='right') - np.searchsorted(ends, t, side='right')
+        return int(count)
+
+    def positions(self, start, end=None, units=None) -> np.ndarray:
+        '''
+        The row positions in stays of the stays that overlap [start, end), or that are in-house at start
+        when end is omitted, on the given unit or list of units (default: all).
+        '''
+        a = _to_ns(start)
+        b = a if end is None else _to_ns(end)
+        found = [self.__trees[unit].overlapping(a, b) for unit in self.__units(units) if unit in self.__trees]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def patients(self, timestamp, units=None) -> pd.DataFrame:
+        '''The stays that are in-house at timestamp on the given unit or list of units (default: all).'''
+        return self.stays.iloc[self.positions(timestamp, None, units)]
+
+    def overlapping(self, start, end, units=None) -> pd.DataFrame:
+        '''The stays that overlap [start, end) on the given unit or list of units (default: all).'''
+        return self.stays.iloc[self.positions(start, end, units)]
+
+    def patient_hours(self, start, end, units=None) -> float:
+        '''The total patient hours between start and end on the given unit or list of units (default: all).'''
+        a = _to_ns(start)
+        b = _to_ns(end)
+        found = self.positions(start, end, units)
+        overlap = np.minimum(self.__ends[found], b) - np.maximum(self.__starts[found], a)
+        return float(np.clip(overlap, 0, None).sum() / np.float64(3600 * 10**9))
+
+    def average_census(self, start, end, units=None) -> float:
+        '''The average number of patients between start and end, the same value an hourly census would average to.'''
+        return self.patient_hours(start, end, units) / ((_to_ns(end) - _to_ns(start)) / np.float64(3600 * 10**9))
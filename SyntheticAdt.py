@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from Encounter import Encounter
+from Event import Event
+import random
+import csv
+import os
+
+# Generates synthetic ADT download files with the same columns as the real extracts, so the
+# pipeline can be tested and benchmarked without any patient information.
+
+default_units = ['ED', 'ICU', 'PCU', 'MED A', 'MED B', 'SURG', 'TELE', 'L&D', 'PEDS', 'OBS']
+default_classes = ['Inpatient', 'Observation', 'Emergency']
+
+
+def _date(value: datetime) -> str:
+    return '<NA>' if value is None else datetime.strftime(value, '%m/%d/%Y')
+
+
+def _time(value: datetime, rng: random.Random) -> str:
+    # the real extracts mix times with and without seconds
+    if value is None:
+        return '<NA>'
+    return datetime.strftime(value, '%I:%M:%S %p' if rng.random() < 0.5 else '%I:%M %p')
+
+
+def generate_encounter(rng: random.Random, har: int, admit: datetime, end_date: datetime, units: list, classes: list,
+                       mean_los_hours: float, transfer_rate: float, cancellation_rate: float, update_rate: float,
+                       dept_synonyms: dict) -> list:
+    '''
+    Returns the csv rows of a single encounter. Event IDs are left as None for the caller to fill in.
+    The length of each unit stay is drawn from an exponential distribution with a mean of
+    mean_los_hours divided among the expected number of units visited, and the encounter is left
+    in-house if it has not been discharged by end_date.
+    '''
+    aliases = {}
+    for alias, unit in dept_synonyms.items():
+        aliases.setdefault(unit, []).append(alias)
+
+    def name(unit: str) -> str:
+        # sometimes refer to a unit by one of its synonyms
+        return rng.choice(aliases[unit]) if unit in aliases and rng.random() < 0.3 else unit
+
+    pt_class = rng.choice(classes)
+    arrival = admit - timedelta(minutes=rng.randint(15, 480)) if rng.random() < 0.4 else None
+    unit = rng.choice(units)
+    transfers = 0
+    while rng.random() < transfer_rate and transfers < 20:
+        transfers += 1
+    stay_hours = mean_los_hours / (1 + transfer_rate)
+    events = [('Admission', admit, '', unit, '', pt_class)]
+    eff_date = admit
+    for i in range(transfers):
+        eff_date = eff_date + timedelta(minutes=max(1, int(rng.expovariate(1 / stay_hours) * 60)))
+        if eff_date >= end_date:
+            break
+        next_unit = rng.choice([u for u in units if u != unit])
+        if rng.random() < cancellation_rate:
+            wrong_unit = rng.choice([u for u in units if u != unit and u != next_unit])
+            events.append(('Transfer In', eff_date, unit, wrong_unit, pt_class, pt_class))
+            events.append(('Transfer In', eff_date, wrong_unit, unit, pt_class, pt_class))
+        events.append(('Transfer In', eff_date, unit, next_unit, pt_class, pt_class))
+        if rng.random() < update_rate:
+            events.append(('Census Update', eff_date, next_unit, next_unit, pt_class, pt_class))
+        unit = next_unit
+    discharge = eff_date + timedelta(minutes=max(1, int(rng.expovariate(1 / stay_hours) * 60)))
+    if discharge < end_date:
+        events.append(('Discharge', discharge, unit, '', pt_class, ''))
+    else:
+        discharge = None
+
+    encounter = {'HAR': har,
+                 'Admit Date': _date(admit),
+                 'Admit Time': datetime.strftime(admit, '%I:%M:%S %p'),
+                 'Arr Date': _date(arrival),
+                 'Arr Time': _time(arrival, rng),
+                 'Disch Date': _date(discharge),
+                 'Disch Time': _time(discharge, rng),
+                 'Disch Disp': 'Home or Self Care' if discharge is not None else '',
+                 'Pt Class': pt_class,
+                 'Admit Dx': 'R07.9',
+                 'Primary Dx': 'I21.4',
+                 'Diagnosis': 'Chest pain'
+                 }
+    rows = []
+    for evt_type, eff_date, from_unit, to_unit, from_class, to_class in events:
+        row = {'Event ID': None,
+               'Event Type': evt_type,
+               'Eff Date': _date(eff_date),
+               'Eff Time': _time(eff_date, rng),
+               'From Unit': name(from_unit) if from_unit else '',
+               'To Unit': name(to_unit) if to_unit else '',
+               'User': f'USER{rng.randint(1, 200):03d}',
+               'From Class': from_class,
+               'To Class': to_class,
+               'Location': 'MAIN CAMPUS'
+               }
+        row.update(encounter)
+        rows.append((eff_date, row))
+    return rows
+
+
+def write_synthetic_extracts(directory: str, start_date: datetime, days: int, encounters_per_day: float = 60,
+                             days_per_file: int = 30, mean_los_hours: float = 96, transfer_rate: float = 0.5,
+                             cancellation_rate: float = 0.05, duplicate_rate: float = 0.02, update_rate: float = 0.1,
+                             units: list = default_units, classes: list = default_classes, dept_synonyms: dict = {},
+                             seed: int = 0) -> list:
+    '''
+    Writes synthetic ADT download files covering days days from start_date into directory and
+    returns their paths. Each file holds the events whose effective dates fall in its days_per_file
+    window, like a series of monthly extracts. duplicate_rate is the fraction of rows that are also
+    written to the next file, as happens with overlapping extracts. Patients admitted in the week
+    before start_date are included so the data starts with patients in-house.
+    '''
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    end_date = start_date + timedelta(days=days)
+    file_count = (days + days_per_file - 1) // days_per_file
+    files = [[] for i in range(file_count)]
+    event_id = 1
+    har = 100000000
+    admit_minutes = int((days + 7) * 24 * 60)
+    for i in range(int((days + 7) * encounters_per_day)):
+        har += 1
+        admit = start_date - timedelta(days=7) + timedelta(minutes=rng.randrange(admit_minutes))
+        for eff_date, row in generate_encounter(rng, har, admit, end_date, units, classes, mean_los_hours, transfer_rate,
+                                                cancellation_rate, update_rate, dept_synonyms):
+            row['Event ID'] = event_id
+            event_id += 1
+            n = min(max((eff_date - start_date).days // days_per_file, 0), file_count - 1)
+            files[n].append(row)
+            if n + 1 < file_count and rng.random() < duplicate_rate:
+                files[n + 1].append(row)
+    headers = list(Encounter.fieldnames.keys()) + list(Event.fieldnames.keys())
+    paths = []
+    for n, rows in enumerate(files):
+        path = os.path.join(directory, f'adt_{n:03d}.csv')
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=headers)
+            writer.writeheader()
+            writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+
+# for testing
+if __name__ == '__main__':
+    import sys
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else './synthetic'
+    print(f'Writing one year of synthetic ADT extracts to "{directory}"...')
+    for path in write_synthetic_extracts(directory, datetime(2021, 1, 1), 365):
+        print(path)
+
+    print('Done!')
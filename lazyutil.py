@@ -0,0 +1,23 @@
+import importlib
+
+
+class LazyModule:
+    '''
+    Stands in for a module that is only imported the first time one of its attributes is used, so
+    the library modules can be imported without loading pandas, numpy, openpyxl or scipy until a
+    function that needs them is called. Once the module is loaded its attributes are copied onto
+    the stand-in, so later lookups cost the same as on the module itself.
+
+        pd = LazyModule('pandas')
+    '''
+
+    def __init__(self, name: str):
+        self.__dict__['_LazyModule__name'] = name
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self.__name!r}>'
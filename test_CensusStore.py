@@ -0,0 +1,26 @@
+from CensusStore import CensusStore
+from xlsxutil import smoothed_data
+import pandas as pd
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    store = CensusStore(tmp_path / 'store')
+    store.append(pd.DataFrame({'Timestamp': pd.date_range('2021-01-01', periods=500, freq='h'),
+                               'A': rng.poisson(20, 500).astype(np.float64), 'B': rng.poisson(5, 500).astype(np.float64)}))
+    return store
+
+
+@pytest.mark.parametrize('window_length', [6, 7, 8, 25])
+@pytest.mark.parametrize('chunk_rows', [25, 60, 499])
+def test_smoothed_chunks_match_full_smoothing(store, window_length, chunk_rows):
+    chunks = pd.concat(list(store.smoothed(['A', 'B'], window_length, 2, chunk_rows=chunk_rows)))
+    pd.testing.assert_frame_equal(chunks, smoothed_data(store.read(), ['A', 'B'], window_length, 2))
+
+
+def test_smoothed_range_shorter_than_window(store):
+    with pytest.raises(ValueError):
+        store.smoothed(['A'], 25, 2, pd.Timestamp('2021-01-01'), pd.Timestamp('2021-01-01 10:00'))
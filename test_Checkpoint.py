@@ -0,0 +1,50 @@
+from CensusStore import CensusStore
+import Checkpoint
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def memory_mapped(values: np.ndarray) -> bool:
+    # follows the chain of views back to the array that owns the memory
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = getattr(values, 'base', None)
+    return False
+
+
+def test_load_frame_is_memory_mapped(tmp_path):
+    df = pd.DataFrame({'census': np.arange(48, dtype=np.float64), 'count': np.arange(48),
+                       'Timestamp': pd.date_range('2021-01-01', periods=48, freq='h')})
+    Checkpoint.save_frame(df, tmp_path)
+    loaded = Checkpoint.load_frame(tmp_path)
+    pd.testing.assert_frame_equal(loaded, df)
+    for name in loaded.columns:
+        assert memory_mapped(loaded[name].to_numpy())
+        assert not loaded[name].to_numpy().flags.writeable
+    loaded = Checkpoint.load_frame(tmp_path, mmap=False)
+    assert not any(memory_mapped(loaded[name].to_numpy()) for name in loaded.columns)
+
+
+def test_range_index_round_trip(tmp_path):
+    store = CensusStore(tmp_path / 'store')
+    census = pd.DataFrame({'Timestamp': pd.date_range('2021-01-01', periods=72, freq='h'), 'ICU': np.arange(72.0)})
+    store.append(census)
+    df = store.read(pd.Timestamp('2021-01-02'), pd.Timestamp('2021-01-03'))
+    Checkpoint.save_frame(df, tmp_path / 'checkpoint')
+    loaded = Checkpoint.load_frame(tmp_path / 'checkpoint')
+    assert isinstance(loaded.index, pd.RangeIndex)
+    pd.testing.assert_frame_equal(loaded, df)
+
+
+def test_number_column_names_round_trip(tmp_path):
+    df = pd.DataFrame({50: [1.0, 2.0], 90: [3.0, 4.0]}, index=pd.Index([10, 20], name='Id'))
+    Checkpoint.save_frame(df, tmp_path)
+    pd.testing.assert_frame_equal(Checkpoint.load_frame(tmp_path), df)
+
+
+def test_unsupported_column_names_are_rejected(tmp_path):
+    df = pd.DataFrame({('ICU', 'Inpatient'): [1.0, 2.0]})
+    with pytest.raises(TypeError):
+        Checkpoint.save_frame(df, tmp_path)
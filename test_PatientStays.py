@@ -0,0 +1,47 @@
+from datetime import datetime
+import SyntheticAdt
+import AdtEvents as adt
+import PatientStays as ps
+import PatientCensus as pc
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope='module')
+def events(tmp_path_factory):
+    files = SyntheticAdt.write_synthetic_extracts(tmp_path_factory.mktemp('adt'), datetime(2021, 1, 1), 14, encounters_per_day=20)
+    return adt.read_from_csv(files)
+
+
+def test_dictionary_missing_unit_raises(events):
+    dictionary = ps.build_dictionary(events)
+    dictionary = ps.StayDictionary([u for u in dictionary.units if u != 'ICU'], dictionary.classes)
+    with pytest.raises(ValueError, match='ICU'):
+        ps.build_dataset(events, dictionary=dictionary)
+
+
+def test_dictionary_missing_class_raises(events):
+    dictionary = ps.build_dictionary(events)
+    dictionary = ps.StayDictionary(dictionary.units, [c for c in dictionary.classes if c != 'Inpatient'])
+    with pytest.raises(ValueError, match='Inpatient'):
+        ps.build_dataset(events, dictionary=dictionary)
+
+
+def test_categorical_stays_match_strings(events):
+    stays = ps.build_dataset(events)
+    strings = ps.build_dataset(events, categorical=False)
+    assert stays['unit'].isna().sum() == strings['unit'].isna().sum()
+    assert (stays['unit'].astype(object).fillna('') == strings['unit'].fillna('')).all()
+    start, end = events.start_date, events.end_date
+    census = pc.build_DataFrame(start, end, stays)
+    expected = pc.build_DataFrame(start, end, strings)
+    assert sorted(census.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(census[expected.columns], expected)
+
+
+def test_stats_count_updates_separately(events):
+    stats = {}
+    ps.build_dataset(events, stats=stats)
+    all_events = [event for event_set in events.data.values() for event in event_set]
+    assert stats['updates_dropped'] == sum(1 for e in all_events if e.evt_type == 'Update')
+    assert stats['no_unit_change_dropped'] == sum(1 for e in all_events if e.evt_type != 'Update' and e.from_unit == e.to_unit)
@@ -0,0 +1,24 @@
+from xlsxutil import IncrementalSmoother, smoothed_data
+import pandas as pd
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def census():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'A': rng.poisson(20, 60).astype(np.float64), 'B': rng.poisson(5, 60).astype(np.float64)})
+
+
+@pytest.mark.parametrize('window_length', [5, 6, 7, 8, 25])
+@pytest.mark.parametrize('sizes', [[20], [1, 1, 1], [7, 13]])
+def test_incremental_appends_match_full_smoothing(census, window_length, sizes):
+    smoother = IncrementalSmoother(['A', 'B'], window_length, 2)
+    rows = 60 - sum(sizes)
+    result = smoother.smooth(census.iloc[:rows])
+    for size in sizes:
+        changed = smoother.append(census.iloc[rows:rows + size])
+        assert changed.index[0] == rows - window_length // 2
+        result = pd.concat([result.iloc[:len(result) - window_length // 2], changed])
+        rows += size
+        pd.testing.assert_frame_equal(result, smoothed_data(census.iloc[:rows], ['A', 'B'], window_length, 2))
@@ -1,11 +1,15 @@
 
-from pandas import DataFrame
+from __future__ import annotations
 from datetime import timedelta
+from lazyutil import LazyModule
 import os
-import pandas as pd
-import openpyxl
-import numpy as np
-import scipy.signal as sig
+import calendar
+import warnings
+
+# pandas, numpy and scipy are only imported when a function that uses them is first called
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+sig = LazyModule('scipy.signal')
 
 one_hour = timedelta(seconds=3600)
 
@@ -24,12 +28,92 @@ def add_to_multimap(multimap: dict, key, value) -> None:
         multimap[key] = [value]
 
 
-def insert_smoothed_data(df: DataFrame, columnName: str, window_length: int, polyorder: int, index: int = 0) -> None:
+def insert_smoothed_data(df: pd.DataFrame, columnName: str, window_length: int, polyorder: int, index: int = 0) -> None:
     smoothed = sig.savgol_filter(df[columnName], window_length, polyorder)
     df.insert(index, columnName + ' - Smoothed', smoothed, True)
 
 
-def create_xlsx_with_tables(file_name: str, descriptors: list) -> None:
+def smoothed_data(df: pd.DataFrame, columns: list, window_length: int, polyorder: int) -> pd.DataFrame:
+    '''
+    Applies a Savitzky-Golay filter to all of the columns at once and returns the results in a new
+    DataFrame with the same index and columns named like those from insert_smoothed_data().
+    '''
+    smoothed = sig.savgol_filter(df[columns].to_numpy(dtype=np.float64), window_length, polyorder, axis=0)
+    return pd.DataFrame(smoothed, index=df.index, columns=[str(c) + ' - Smoothed' for c in columns])
+
+
+def rolling_mean_data(df: pd.DataFrame, columns: list, window: int) -> pd.DataFrame:
+    '''Returns the trailing rolling mean of all of the columns over window rows.'''
+    rolling = df[columns].rolling(window, min_periods=1).mean()
+    rolling.columns = [str(c) + ' - Rolling Mean' for c in columns]
+    return rolling
+
+
+def hour_of_week_percentiles(df: pd.DataFrame, columns: list, percentiles: list = [50, 90]) -> pd.DataFrame:
+    '''
+    Returns the percentiles of each of the columns for each hour of the week, with one row per
+    (Weekday, Hour) in calendar order and one column per (column, percentile).
+    '''
+    timestamps = pd.DatetimeIndex(df['Timestamp'])
+    groups = df[columns].groupby([timestamps.dayofweek, timestamps.hour])
+    result = pd.concat({p: groups.quantile(p / 100) for p in percentiles}, axis=1)
+    result = result.swaplevel(axis=1)[[(c, p) for c in columns for p in percentiles]]
+    result.index = result.index.set_levels([calendar.day_name[d] for d in result.index.levels[0]], level=0)
+    result.index.names = ['Weekday', 'Hour']
+    return result
+
+
+def add_smoothed_data(df: pd.DataFrame, columns: list, window_length: int, polyorder: int, rolling_window: int = None) -> pd.DataFrame:
+    '''
+    Batch version of insert_smoothed_data(). Smooths all of the columns, and optionally adds their rolling
+    means, and returns a new DataFrame with the results appended in a single concat.
+    '''
+    parts = [df, smoothed_data(df, columns, window_length, polyorder)]
+    if rolling_window:
+        parts.append(rolling_mean_data(df, columns, rolling_window))
+    return pd.concat(parts, axis=1)
+
+
+class IncrementalSmoother:
+    '''
+    Keeps Savitzky-Golay smoothed columns up to date as new rows are appended to a census.
+
+    With scipy's default 'interp' mode, appending rows can only change the smoothed values of the last
+    window_length // 2 existing rows. Each of those must be smoothed with the full filter, which for an
+    even window reaches one row further back than forward, so append() refilters the last
+    2 * (window_length // 2) raw rows together with the new ones and returns the smoothed rows that
+    changed. The results are identical to smoothing the whole history again, for odd and even windows.
+    '''
+
+    def __init__(self, columns: list, window_length: int, polyorder: int):
+        self.columns = columns
+        self.window_length = window_length
+        self.polyorder = polyorder
+        self.tail = None
+        # the number of raw rows kept for the next append(), which is window_length - 1 for an odd window
+        self.__tail_rows = 2 * (window_length // 2)
+
+    def smooth(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''Smooths the full history and remembers the rows needed for the next append().'''
+        self.tail = df[self.columns].iloc[-self.__tail_rows:]
+        return smoothed_data(df, self.columns, self.window_length, self.polyorder)
+
+    def append(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Returns the smoothed values of every row whose value changed: the last window_length // 2 rows
+        seen so far followed by new_rows. Replace those rows in the existing smoothed data with them.
+        '''
+        if self.tail is None:
+            raise ValueError('smooth() must be called before append().')
+        if len(self.tail) < self.__tail_rows:
+            raise ValueError('There are too few rows to update incrementally; call smooth() on the whole history.')
+        history = pd.concat([self.tail, new_rows[self.columns]])
+        smoothed = smoothed_data(history, self.columns, self.window_length, self.polyorder)
+        self.tail = history.iloc[-self.__tail_rows:]
+        return smoothed.iloc[self.window_length // 2:]
+
+
+def create_xlsx_with_tables(file_name: str, descriptors: list, chunk_rows: int = 10000) -> None:
     '''
     Creates a new xlsx file with multiple tables in separate sheets, each built from a different pandas DataFrame.
 
@@ -45,28 +129,46 @@ def create_xlsx_with_tables(file_name: str, descriptors: list) -> None:
                                'data_frame': df2,
                                'display_name': 'displayname2'
                                }]
-    '''
 
-    file_name = os.path.abspath(file_name)
+    The workbook is written in a single streaming pass with an openpyxl write-only workbook, so rows
+    are serialized as they are produced and each table is defined as its sheet is written, instead
+    of saving the workbook with pandas, loading it again to add the tables, and saving it twice.
+    DataFrames are converted chunk_rows rows at a time, and tables can have any number of columns.
+    '''
 
-    with pd.ExcelWriter(file_name) as writer:
-        for desc in descriptors:
-            df = desc['data_frame']
-            if not df.index.name:
-                df.index.name = 'Id'
-            df.to_excel(writer, sheet_name=desc['sheet_name'])
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.table import Table, TableColumn
 
-    wb = openpyxl.load_workbook(filename=file_name)
+    file_name = os.path.abspath(file_name)
 
+    wb = openpyxl.Workbook(write_only=True)
     for desc in descriptors:
         df = desc['data_frame']
-        xlscols = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
-                   'AA', 'AB', 'AC', 'AD', 'AE', 'AF', 'AG', 'AH', 'AI', 'AJ', 'AK', 'AL', 'AM', 'AN', 'AO', 'AP', 'AQ', 'AR', 'AS', 'AT', 'AU', 'AV', 'AW', 'AX', 'AY', 'AZ',
-                   'BA', 'BB', 'BC', 'BD', 'BE', 'BF', 'BG', 'BH', 'BI', 'BJ', 'BK', 'BL', 'BM', 'BN', 'BO', 'BP', 'BQ', 'BR', 'BS', 'BT', 'BU', 'BV', 'BW', 'BX', 'BY', 'BZ']
+        if not df.index.name:
+            df.index.name = 'Id'
+        ws = wb.create_sheet(title=desc['sheet_name'])
+        headers = [str(df.index.name)] + [str(c) for c in df.columns]
+        ws.append(headers)
+        for start in range(0, df.shape[0], chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            columns = [_cell_values(chunk.index.to_series())]
+            columns.extend(_cell_values(chunk.iloc[:, i]) for i in range(chunk.shape[1]))
+            for row in zip(*columns):
+                ws.append(row)
         rows = df.shape[0] + 1
-        cols = xlscols[df.shape[1]]
+        cols = get_column_letter(df.shape[1] + 1)
         refs = f'A1:{cols}{rows}'
-        tab = openpyxl.worksheet.table.Table(displayName=desc['display_name'], ref=refs)
-        wb[desc['sheet_name']].add_table(tab)
-
+        tab = Table(displayName=desc['display_name'], ref=refs)
+        tab.tableColumns = [TableColumn(id=i + 1, name=h) for i, h in enumerate(headers)]
+        with warnings.catch_warnings():
+            # the table columns are added above, which is what this warning asks for
+            warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually')
+            ws.add_table(tab)
     wb.save(file_name)
+
+
+def _cell_values(column: pd.Series) -> list:
+    # converts a column to a list of values that openpyxl can write, with None for missing values
+    values = column.astype(object)
+    return values.where(column.notna(), None).tolist()